@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import json
+import resource
+import threading
+import time
+
+import grpc
+from node import Pokemon, Server, Trainer
+
+
+"""
+The Latency Recorder class
+
+A gRPC client interceptor that times every unary call made through the channels it wraps, by RPC name
+"""
+class LatencyRecorder(grpc.UnaryUnaryClientInterceptor):
+
+    def __init__(self):
+        self.latencies = {}                 # Dict: key = RPC name (string), value = list of call latencies in seconds ([float])
+        self._lock = threading.Lock()
+        return
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        start = time.perf_counter()
+        response = continuation(client_call_details, request)
+        response.result()
+        elapsed = time.perf_counter() - start
+
+        name = client_call_details.method.rsplit('/', 1)[-1]
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+        return response
+
+    # Returns the count, p50 and p99 latency (in milliseconds) of every RPC that was called
+    def summary(self):
+        with self._lock:
+            latencies = {name: sorted(times) for name, times in self.latencies.items()}
+
+        return {name: {"count": len(times),
+                       "p50_ms": round(percentile(times, 50) * 1000, 3),
+                       "p99_ms": round(percentile(times, 99) * 1000, 3)} for name, times in latencies.items()}
+
+
+# Returns the p-th percentile of an already sorted list
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+
+"""
+The Benchmark class
+
+Starts a PokemonOU server on localhost, and plays a whole game against it with the real Trainer and Pokemon classes,
+each running on its own thread instead of its own container
+
+Reports, as one JSON object:
+    - The p50 and p99 latency of every RPC, as seen by the clients
+    - Steps per second, and ticks per second when the server owns the clock
+    - The time spent waiting on board region locks
+    - The peak resident memory of the process (the server and every client together)
+    - The time until every pokemon was captured, or null if the game did not finish in time
+
+With world_cache set, every client keeps its own copy of the board and picks its own moves, instead of calling step
+With plan_every set, the server assigns every trainer its own pokemon to chase, redone every plan_every ticks
+With flee set to "field", the server steers every pokemon with a distance field to all trainers
+"""
+class Benchmark():
+
+    def __init__(self, board_size, num_trainers, num_pkmn, tick_interval=0, max_workers=8, timeout=300, world_cache=False, plan_every=None,
+                 flee="nearest"):
+        self.board_size = board_size
+        self.num_trainers = num_trainers
+        self.num_pkmn = num_pkmn
+        self.tick_interval = tick_interval
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.world_cache = world_cache
+        self.plan_every = plan_every
+        self.flee = flee
+
+        self.server = Server()
+        self.recorder = LatencyRecorder()
+        self.ready = threading.Event()
+        return
+
+    # Serves the game on a background event loop until stop is set
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+
+        await self.server.start_async(self.board_size, self.num_pkmn, self.tick_interval, self.max_workers, address='localhost:0',
+                                      plan_every=self.plan_every, flee=self.flee)
+        self.ready.set()
+
+        try:
+            await self.stop.wait()
+        finally:
+            await self.server.stop_async()
+        return
+
+    # Plays one game and returns its results
+    def run(self):
+        server_thread = threading.Thread(target=asyncio.run, args=(self.serve(),), daemon=True)
+        server_thread.start()
+        self.ready.wait()
+        game = self.server.game
+
+        address = f"localhost:{self.server.port}"
+        board_size = self.board_size if self.world_cache else None
+        clients = [Trainer(f"trainer{i}", address, [self.recorder], board_size=board_size) for i in range(self.num_trainers)]
+        clients += [Pokemon(f"pokemon{i}", address, [self.recorder], board_size=board_size) for i in range(self.num_pkmn)]
+        threads = [threading.Thread(target=client.run, daemon=True) for client in clients]
+
+        # Play until every pokemon is captured, or time runs out
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        while game.status != "over" and time.perf_counter() - start < self.timeout:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        finished = game.status == "over"
+
+        for t in threads:
+            t.join(max(0, self.timeout - (time.perf_counter() - start)))
+
+        self.loop.call_soon_threadsafe(self.stop.set)
+        server_thread.join()
+
+        rpcs = self.recorder.summary()
+        steps = rpcs.get("step", {}).get("count", 0) + rpcs.get("agent_step", {}).get("count", 0)
+        ticks = game.scheduler.tick if game.scheduler is not None else None
+
+        return {
+            "board_size": self.board_size,
+            "trainers": self.num_trainers,
+            "pokemon": self.num_pkmn,
+            "tick_interval": self.tick_interval,
+            "max_workers": self.max_workers,
+            "world_cache": self.world_cache,
+            "plan_every": self.plan_every,
+            "flee": self.flee,
+            "finished": finished,
+            "time_to_capture_all_sec": round(elapsed, 3) if finished else None,
+            "captured": game.capture_counter,
+            "steps": steps,
+            "steps_per_sec": round(steps / elapsed, 1),
+            "ticks": ticks,
+            "ticks_per_sec": round(ticks / elapsed, 1) if ticks is not None else None,
+            "lock_wait_sec": round(sum(game.regions.wait_times), 4),
+            "lock_waits": sum(game.regions.waits),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "rpc": rpcs,
+        }
+
+
+
+"""
+Reads the command-line arguments
+
+Only the board size and the numbers of trainers and pokemon are required - every other setting is a named flag
+There are only 50 people emojis and 66 animal emojis, so keep the number of trainers and pokemon at or below those
+"""
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Plays a whole PokemonOU game against a local server and reports how fast it went, as JSON')
+    parser.add_argument('board_size', type=int, help='size of the board')
+    parser.add_argument('trainers', type=int, help='number of Trainers')
+    parser.add_argument('pokemon', type=int, help='number of Pokemon')
+    clock = parser.add_mutually_exclusive_group()
+    clock.add_argument('--tick', type=float, default=0, help='length of a server-owned tick in seconds, 0 (the default) for lockstep')
+    clock.add_argument('--client-pace', action='store_true', help='let every client play at its own pace of one turn per second')
+    parser.add_argument('--workers', type=int, default=8, help='number of worker threads the server uses for blocking game work')
+    parser.add_argument('--results', help='file to append the results to, as one line of JSON per run')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for every pokemon to be captured')
+    parser.add_argument('--cache', action='store_true', help='have every client keep a world cache and pick its own moves')
+    parser.add_argument('--plan-every', type=int, help='number of ticks between plans of which pokemon each trainer chases')
+    parser.add_argument('--field', action='store_true', help='steer every pokemon with a distance field to all trainers')
+    return parser.parse_args()
+
+
+
+"""
+Start of Program Logic
+
+Usage: python benchmark.py <board size> <number of trainers> <number of pokemon> [--tick seconds | --client-pace] [--workers n]
+                           [--results file] [--timeout seconds] [--cache] [--plan-every ticks] [--field]
+
+The results are printed, and also appended to the results file if one is given
+"""
+if __name__ == '__main__':
+    args = parse_arguments()
+    tick_interval = None if args.client_pace else args.tick
+    flee = "field" if args.field else "nearest"
+
+    results = Benchmark(args.board_size, args.trainers, args.pokemon, tick_interval, args.workers, args.timeout, args.cache, args.plan_every,
+                        flee).run()
+
+    print(json.dumps(results, indent=2))
+    if args.results is not None:
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(results) + '\n')
@@ -1,6 +1,5 @@
-import io
+import argparse
 import subprocess
-import sys
 
 """
 Gets the input values from the user
@@ -12,13 +11,37 @@ def getInputParameters():
     return gridsize, numT, numP
 
 
+"""
+Reads the command-line flags
+
+Any of the grid size, number of Trainers, and number of Pokemon that are not given are asked for instead
+"""
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Generates the docker-compose.yml file and Dockerfile for a game of PokemonOU')
+    parser.add_argument('--grid', type=int, help='size of the grid')
+    parser.add_argument('--trainers', type=int, help='number of Trainers')
+    parser.add_argument('--pokemon', type=int, help='number of Pokemon')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker containers to spread the Trainers and Pokemon across, 0 for a container each')
+    parser.add_argument('--barrier', action='store_true', help='hold the game until every Trainer and Pokemon has connected')
+    parser.add_argument('up', nargs='?', choices=['up'], help='run docker-compose up once the files are written')
+    args = parser.parse_args()
+
+    if args.grid is None or args.trainers is None or args.pokemon is None:
+        args.grid, args.trainers, args.pokemon = getInputParameters()
+
+    return args
+
+
 """
 Generates a docker-compose.yml file
 
 Creates 1 server machine, numT trainers, and numP pokemon with their own containers
+With workers given, the trainers and pokemon are instead spread as evenly as possible across that many worker containers,
+each running its share of them in one process
 Also creates a default network that each container can use 
 """
-def generateDockerComposeYML(numT, numP):
+def generateDockerComposeYML(numT, numP, workers=0):
 
     version='version: \'3.7\'\n\n'
     header='services:\n'
@@ -33,15 +56,24 @@ def generateDockerComposeYML(numT, numP):
         for line in serverLines:
             dcfile.write(line + '\n')
 
+        # Create a worker machine for each share of the trainers and pokemon
+        #   Each worker is told the range of trainer and pokemon numbers it runs, such as 0-9, or nothing if it has none
+        for k in range(0, workers):
+            trainers = agentRange(k * numT // workers, (k + 1) * numT // workers)
+            pokemon = agentRange(k * numP // workers, (k + 1) * numP // workers)
+            workerLines=['  worker' + str(k) +':', '    build: .', '    hostname: worker' + str(k), '    container_name: Worker' + str(k), '    environment:', '       - TRAINERS=' + trainers, '       - POKEMON=' + pokemon, '    depends_on:', '       - \"server\"', '    networks:', '       - default']
+            for line in workerLines:
+                dcfile.write(line + '\n')
+
         # Create a new machine for each trainer
-        for i in range(0, numT):
+        for i in range(0, numT if workers == 0 else 0):
             trainerLines=['  client' + str(i) +':', '    build: .', '    hostname: trainer' + str(i), '    container_name: Trainer' + str(i), '    depends_on:', '       - \"server\"', '    networks:', '       - default']
             for line in trainerLines:
                 dcfile.write(line + '\n')
 
         # Create a new machine for each pokemon
-        for i in range(0, numP):
-            pokemonLines=['  client' + str(i + numTrainers) +':', '    build: .', '    hostname: pokemon' + str(i), '    container_name: Pokemon' + str(i), '    depends_on:', '       - \"server\"', '    networks:', '       - default']
+        for i in range(0, numP if workers == 0 else 0):
+            pokemonLines=['  client' + str(i + numT) +':', '    build: .', '    hostname: pokemon' + str(i), '    container_name: Pokemon' + str(i), '    depends_on:', '       - \"server\"', '    networks:', '       - default']
             for line in pokemonLines:
                 dcfile.write(line + '\n')
 
@@ -53,14 +85,26 @@ def generateDockerComposeYML(numT, numP):
     return
 
 
+"""
+Returns the range of agent numbers from first up to (but not including) last, in the form node.py reads from a worker's
+environment - "3-7" for agents 3 to 7, or an empty string if there are none
+"""
+def agentRange(first, last):
+    if first >= last:
+        return ''
+    return str(first) + '-' + str(last - 1)
+
+
 """
 Adds the command-line argument for the size of the board to the Dockerfile
+With num_trainers given, the server also holds the game until that many trainers and every pokemon have connected
 """
-def modifyDockerfile(boardsize, num_pkmn):
+def modifyDockerfile(boardsize, num_pkmn, num_trainers=None):
     
     # Rewrite the last line to add the command-line arguments
     lines = open('Dockerfile', 'r').readlines()
-    lines[len(lines) - 1] = 'CMD [\"python3\", \"node.py\", \"' + str(boardsize) + '\",  \"' + str(num_pkmn) + '\"]'
+    barrier = '' if num_trainers is None else ', \"--trainers\", \"' + str(num_trainers) + '\"'
+    lines[len(lines) - 1] = 'CMD [\"python3\", \"node.py\", \"' + str(boardsize) + '\",  \"' + str(num_pkmn) + '\"' + barrier + ']'
     with open('Dockerfile', 'w') as file:
         file.writelines(lines)
 
@@ -69,18 +113,19 @@ def modifyDockerfile(boardsize, num_pkmn):
 
 """
 Start of Program Logic
+
+Usage: python docker-generate.py [--grid N] [--trainers N] [--pokemon N] [--workers K] [--barrier] [up]
 """
 if __name__ == '__main__':
-    # Get the input parameters
-    gridsize, numTrainers, numPokemon = getInputParameters()
+    # Get the input parameters, from the command line or else from the user
+    args = parseArguments()
 
     # Create the docker-compose file based off of these parameters
-    generateDockerComposeYML(numTrainers, numPokemon)
+    generateDockerComposeYML(args.trainers, args.pokemon, args.workers)
 
     # Add board size argument in Dockerfile
-    modifyDockerfile(gridsize, numPokemon)
+    modifyDockerfile(args.grid, args.pokemon, args.trainers if args.barrier else None)
 
     # Call the docker-compose command from here
-    # TODO: Add command-line arguments on whether to run or not
-    if sys.argv[-1] == "up":
+    if args.up == "up":
         subprocess.run(["docker-compose", "up"])
\ No newline at end of file
@@ -0,0 +1,236 @@
+import math
+import sys
+import time
+
+import numpy as np
+
+
+"""
+Returns, for every query location, the index of the nearest target location (or -1 if there are no targets)
+
+Targets are bucketed into a uniform grid sized to hold about one target per bucket, and every query walks outward
+ring by ring until nothing left to search could be closer than its best match so far
+Ties are broken by the lower target index, matching the registration order tie-break of the server's SpatialGrid
+"""
+def nearest_indices(qx, qy, tx, ty, board_size):
+
+    best = np.full(len(qx), -1, dtype=np.int64)
+    if len(tx) == 0 or len(qx) == 0:
+        return best
+
+    # Sort the targets by bucket, and find where each bucket starts and ends in the sorted order
+    cell = max(1, math.ceil(board_size / math.sqrt(len(tx))))
+    num_cells = (board_size + cell - 1) // cell
+    buckets = (tx // cell) * num_cells + (ty // cell)
+    order = np.argsort(buckets)
+    ends = np.cumsum(np.bincount(buckets, minlength=num_cells * num_cells))
+    starts = ends - np.bincount(buckets, minlength=num_cells * num_cells)
+
+    # Each query keeps its best match as one key, squared distance * len(tx) + index, so ties go to the lower index
+    qbx = qx // cell
+    qby = qy // cell
+    best_key = np.full(len(qx), np.iinfo(np.int64).max, dtype=np.int64)
+    active = np.arange(len(qx))
+
+    for ring in range(num_cells):
+
+        # Every location in this ring is at least (ring - 1) * cell + 1 away on one axis
+        if ring > 0:
+            active = active[best_key[active] // len(tx) >= ((ring - 1) * cell + 1)**2]
+        if len(active) == 0:
+            break
+
+        # Visit every bucket of this ring for every active query at once
+        ox, oy = ring_offsets(ring)
+        bx = (qbx[active][:, None] + ox).ravel()
+        by = (qby[active][:, None] + oy).ravel()
+        inside = (bx >= 0) & (bx < num_cells) & (by >= 0) & (by < num_cells)
+
+        queries = np.repeat(active, len(ox))[inside]
+        first = starts[bx[inside] * num_cells + by[inside]]
+        count = ends[bx[inside] * num_cells + by[inside]] - first
+
+        # Pair every query with every target in the buckets it visits
+        q = np.repeat(queries, count)
+        t = order[np.repeat(first, count) + np.arange(len(q)) - np.repeat(np.cumsum(count) - count, count)]
+
+        d2 = (qx[q] - tx[t])**2 + (qy[q] - ty[t])**2
+        np.minimum.at(best_key, q, d2 * len(tx) + t)
+
+    found = best_key != np.iinfo(np.int64).max
+    best[found] = best_key[found] % len(tx)
+
+    return best
+
+
+"""
+Returns the x and y offsets of the buckets that are exactly ring buckets away from the center bucket
+"""
+def ring_offsets(ring):
+    if ring == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    side = np.arange(-ring, ring + 1)
+    inner = np.arange(-ring + 1, ring)
+    ox = np.concatenate((side, side, np.full(len(inner), -ring), np.full(len(inner), ring)))
+    oy = np.concatenate((np.full(len(side), -ring), np.full(len(side), ring), inner, inner))
+    return ox, oy
+
+
+"""
+Applies one batch of moves and returns the new x and y arrays
+
+Moves are clamped to the board, and happen at the same time:
+    - A move onto a spot held by another client at the start of the batch is rejected
+    - When several clients move onto the same free spot, the lowest numbered one gets it
+"""
+def resolve_moves(x, y, nx, ny, board_size):
+
+    nx = np.clip(nx, 0, board_size - 1)
+    ny = np.clip(ny, 0, board_size - 1)
+
+    current = x * board_size + y
+    target = nx * board_size + ny
+
+    # Only moves onto a spot that nobody held at the start of the batch can go through
+    candidates = np.flatnonzero((target != current) & ~np.isin(target, current))
+    _, first = np.unique(target[candidates], return_index=True)
+    winners = candidates[first]
+
+    x = x.copy()
+    y = y.copy()
+    x[winners] = nx[winners]
+    y[winners] = ny[winners]
+
+    return x, y
+
+
+
+"""
+The Headless Game class
+
+Runs a whole PokemonOU game inside one process, with no gRPC, no containers and no sleeping between turns
+Every trainer and pokemon location lives in NumPy arrays, and each turn is computed with batched array operations
+
+Each turn follows the rules of Trainer.run and Pokemon.run:
+    - Every trainer captures the pokemon on its spot, otherwise moves one spot towards the nearest pokemon and attempts a capture again
+    - Every pokemon that is still free moves one spot directly away from the nearest trainer
+"""
+class HeadlessGame():
+
+    def __init__(self, board_size, num_trainers, total_pkmn, seed=None):
+
+        # Initialize variables
+        self.board_size = board_size
+        self.num_trainers = num_trainers
+        self.num_pkmn = total_pkmn
+        self.rng = np.random.default_rng(seed)
+
+        self.tick = 0
+        self.capture_counter = 0
+        self.finish_tick = None             # The tick at which every pokemon had been captured, None until then
+
+        # Spawn every client on its own spot
+        cells = self.rng.choice(board_size * board_size, size=num_trainers + total_pkmn, replace=False).astype(np.int64)
+
+        self.trainer_x = cells[:num_trainers] // board_size
+        self.trainer_y = cells[:num_trainers] % board_size
+
+        # Only free pokemon are kept in the location arrays - pokemon_ids maps them back to their number
+        self.pokemon_ids = np.arange(total_pkmn, dtype=np.int64)
+        self.pokemon_x = cells[num_trainers:] // board_size
+        self.pokemon_y = cells[num_trainers:] % board_size
+
+        self.captured_by = np.full(total_pkmn, -1, dtype=np.int64)
+                                            # The number of the trainer that captured each pokemon, -1 while free
+
+        return
+
+    # Captures every free pokemon standing on the same spot as one of the given trainers
+    def capture(self, trainers):
+        trainer_cells = self.trainer_x[trainers] * self.board_size + self.trainer_y[trainers]
+        pokemon_cells = self.pokemon_x * self.board_size + self.pokemon_y
+
+        # Spots are never shared by two clients of the same type, so each match is one trainer and one pokemon
+        _, t_idx, p_idx = np.intersect1d(trainer_cells, pokemon_cells, assume_unique=True, return_indices=True)
+
+        self.captured_by[self.pokemon_ids[p_idx]] = trainers[t_idx]
+        self.capture_counter += len(p_idx)
+
+        free = np.ones(len(self.pokemon_ids), dtype=bool)
+        free[p_idx] = False
+        self.pokemon_ids = self.pokemon_ids[free]
+        self.pokemon_x = self.pokemon_x[free]
+        self.pokemon_y = self.pokemon_y[free]
+
+        return trainers[t_idx]
+
+    # Plays one turn for every client on the board
+    def play_turn(self):
+        self.tick += 1
+
+        # Trainers capture on their spot
+        trainers = np.arange(self.num_trainers)
+        capturers = self.capture(trainers)
+
+        # The rest move one spot towards the nearest pokemon and attempt a capture again
+        if len(self.pokemon_ids) > 0:
+            movers = np.setdiff1d(trainers, capturers, assume_unique=True)
+            nearest = nearest_indices(self.trainer_x[movers], self.trainer_y[movers], self.pokemon_x, self.pokemon_y, self.board_size)
+
+            nx = self.trainer_x.copy()
+            ny = self.trainer_y.copy()
+            nx[movers] += np.sign(self.pokemon_x[nearest] - self.trainer_x[movers])
+            ny[movers] += np.sign(self.pokemon_y[nearest] - self.trainer_y[movers])
+            self.trainer_x, self.trainer_y = resolve_moves(self.trainer_x, self.trainer_y, nx, ny, self.board_size)
+
+            self.capture(movers)
+
+        # Free pokemon move one spot directly away from the nearest trainer
+        if len(self.pokemon_ids) > 0 and self.num_trainers > 0:
+            nearest = nearest_indices(self.pokemon_x, self.pokemon_y, self.trainer_x, self.trainer_y, self.board_size)
+
+            nx = self.pokemon_x + np.sign(self.pokemon_x - self.trainer_x[nearest])
+            ny = self.pokemon_y + np.sign(self.pokemon_y - self.trainer_y[nearest])
+            self.pokemon_x, self.pokemon_y = resolve_moves(self.pokemon_x, self.pokemon_y, nx, ny, self.board_size)
+
+        if self.finish_tick is None and self.capture_counter == self.num_pkmn:
+            self.finish_tick = self.tick
+
+        return
+
+    # Plays turns until every pokemon is captured or max_ticks turns have been played, and returns the turns per second
+    def run(self, max_ticks=None):
+        start = time.perf_counter()
+        start_tick = self.tick
+
+        while self.finish_tick is None and (max_ticks is None or self.tick < max_ticks):
+            self.play_turn()
+
+        elapsed = time.perf_counter() - start
+        return (self.tick - start_tick) / elapsed if elapsed > 0 else float('inf')
+
+
+
+"""
+Start of Program Logic
+
+Usage: python engine.py <board size> <number of trainers> <number of pokemon> [seed] [max ticks]
+"""
+
+if __name__ == '__main__':
+    boardsz = int(sys.argv[1])
+    num_trainers = int(sys.argv[2])
+    num_pkmn = int(sys.argv[3])
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    max_ticks = int(sys.argv[5]) if len(sys.argv) > 5 else 100 * boardsz
+
+    game = HeadlessGame(board_size=boardsz, num_trainers=num_trainers, total_pkmn=num_pkmn, seed=seed)
+    ticks_per_sec = game.run(max_ticks=max_ticks)
+
+    print(f"Ticks played: {game.tick}")
+    print(f"Ticks per second: {ticks_per_sec:.1f}")
+    if game.finish_tick is not None:
+        print(f"Every pokemon was captured at tick {game.finish_tick}")
+    else:
+        print(f"{game.num_pkmn - game.capture_counter} of {game.num_pkmn} pokemon were still free after {game.tick} ticks")
@@ -1,20 +1,1144 @@
 from concurrent import futures
 
+import argparse
+import array
+import asyncio
+import bisect
+import collections
+import contextlib
 import emoji
+import functools
+import itertools
 import logging
 import math
+import os
+import pickle
 import random
 import re
+import shutil
 import socket
 import sys
+import tempfile
 import threading
 import time
 
 import grpc
+import numpy as np
 import pokemonou_pb2
 import pokemonou_pb2_grpc
 
 
+"""
+The Region Locks class
+
+Splits the board into square regions of region_size x region_size cells, each with its own lock
+Writers lock only the regions of the cells they change, so clients in different parts of the board move in parallel
+Each region also has a version number that is odd while a writer is changing it, so readers can take a consistent
+snapshot without locking: read the versions, read the data, and retry if any version moved in the meantime
+"""
+class RegionLocks():
+
+    def __init__(self, board_size, region_size=None):
+
+        self.board_size = board_size
+        self.region_size = region_size if region_size is not None else max(1, math.isqrt(board_size))
+        self.num_regions = (board_size + self.region_size - 1) // self.region_size
+
+        self.locks = [threading.Lock() for i in range(self.num_regions * self.num_regions)]
+        self.versions = [0 for i in range(self.num_regions * self.num_regions)]
+
+        # Time spent waiting for each region's lock while another writer held it, and how many times that happened
+        #   Each region's entries are only changed while holding its lock
+        self.wait_times = [0.0 for i in range(self.num_regions * self.num_regions)]
+        self.waits = [0 for i in range(self.num_regions * self.num_regions)]
+
+        # Time each region's lock was held by writers, and how many times it was taken
+        self.hold_times = [0.0 for i in range(self.num_regions * self.num_regions)]
+        self.holds = [0 for i in range(self.num_regions * self.num_regions)]
+
+        return
+
+    # Returns the index of the region at region coordinates (rx, ry)
+    def index(self, rx, ry):
+        return rx * self.num_regions + ry
+
+    # Returns the index of the region that holds the board cell (x, y)
+    def region_of(self, x, y):
+        return self.index(x // self.region_size, y // self.region_size)
+
+    # Locks the regions that hold the given cells for writing
+    #   Regions are always locked in index order, so two writers can never deadlock
+    @contextlib.contextmanager
+    def hold(self, *cells):
+        regions = sorted(set(self.region_of(x, y) for x, y in cells))
+        with self.hold_regions(regions):
+            yield
+        return
+
+    # Locks every region on the board
+    @contextlib.contextmanager
+    def hold_all(self):
+        with self.hold_regions(range(len(self.locks))):
+            yield
+        return
+
+    @contextlib.contextmanager
+    def hold_regions(self, regions):
+        for r in regions:
+            if not self.locks[r].acquire(blocking=False):
+                start = time.perf_counter()
+                self.locks[r].acquire()
+                self.wait_times[r] += time.perf_counter() - start
+                self.waits[r] += 1
+            self.versions[r] += 1
+        acquired = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            held = time.perf_counter() - acquired
+            for r in reversed(regions):
+                self.hold_times[r] += held
+                self.holds[r] += 1
+                self.versions[r] += 1
+                self.locks[r].release()
+        return
+
+    # Calls read(seen) until it runs without any writer touching the regions it recorded in seen
+    #   read must store seen[region] = self.versions[region] before reading anything in that region
+    #   After a few failed attempts the whole board is locked so the read is guaranteed to finish
+    def read(self, read, max_tries=4):
+        for attempt in range(max_tries):
+            seen = {}
+            result = read(seen)
+            if all(version % 2 == 0 and self.versions[r] == version for r, version in seen.items()):
+                return result
+
+        with self.hold_all():
+            return read({})
+
+
+
+"""
+The Free Cells class
+
+Keeps count of the empty cells of every region of the board, so a spawn point can be picked in constant time
+The board itself says which cells are empty, so a region that is at least half empty stores nothing per cell - only a count
+and its bounds - and a spawn point is found by trying random cells of it, which takes two tries on average
+A region more than half full also keeps a list of its empty cells, and where each of them is in that list, so a spawn point
+is one random entry, and filling or emptying a cell moves one entry - two arrays of two bytes per cell of that region,
+built when the region fills past half and dropped once more than five eighths of it is empty again
+If all MAX_TRIES tries of a region without a list land on taken cells, which happens about once in 2 ** MAX_TRIES picks,
+the region's cells are searched for an empty one instead
+Callers must hold the region lock of every cell they look at or change, and tell take and give when a cell fills or empties
+Given a tile (x0, y0, x1, y1), only the cells with x0 <= x < x1 and y0 <= y < y1 are ever handed out
+Random picks are drawn from rng, so a seeded game spawns its clients the same way every time
+"""
+class FreeCells():
+
+    MAX_TRIES = 32                          # Random cells tried in a region without a list before searching it
+
+    def __init__(self, regions, board, tile=None, rng=random):
+
+        self.regions = regions
+        self.board = board                  # The game board, where empty cells hold 0
+        self.board_size = regions.board_size
+        self.rng = rng
+        self.tile = tile if tile is not None else (0, 0, self.board_size, self.board_size)
+        x0, y0, x1, y1 = self.tile
+
+        self.bounds = [None] * len(regions.locks)
+                                            # List of the (xa, ya, xb, yb) part of the tile in each region, indexed by region
+        self.free = [0] * len(regions.locks)
+                                            # List of the number of empty cells of the tile in each region, indexed by region
+        self.lists = [None] * len(regions.locks)
+                                            # List of the (cells, slots) arrays of each region past half full, None for the rest
+                                            #   cells[:free] are the region's empty cells, numbered row by row from (xa, ya),
+                                            #   and slots[cell] is where an empty cell is in cells
+
+        # Every cell of the tile starts out empty
+        size = regions.region_size
+        for rx in range(regions.num_regions):
+            for ry in range(regions.num_regions):
+                xa, xb = max(x0, rx * size), min(x1, (rx + 1) * size)
+                ya, yb = max(y0, ry * size), min(y1, (ry + 1) * size)
+                region = regions.index(rx, ry)
+                self.bounds[region] = (xa, ya, max(xa, xb), max(ya, yb))
+                self.free[region] = max(0, xb - xa) * max(0, yb - ya)
+
+        return
+
+    # Returns True if (x, y) is on the tile
+    def on_tile(self, x, y):
+        x0, y0, x1, y1 = self.tile
+        return x0 <= x < x1 and y0 <= y < y1
+
+    # Returns the number of cells of the tile in a region
+    def area(self, region):
+        xa, ya, xb, yb = self.bounds[region]
+        return (xb - xa) * (yb - ya)
+
+    # Returns the number of a cell within its region, counted row by row from the region's corner
+    def cell_number(self, region, x, y):
+        xa, ya, xb, yb = self.bounds[region]
+        return (x - xa) * (yb - ya) + (y - ya)
+
+    # Builds the list of empty cells of a region from the board
+    def build_list(self, region):
+        xa, ya, xb, yb = self.bounds[region]
+        area = self.area(region)
+        dtype = np.uint16 if area <= 1 << 16 else np.uint32
+
+        empty = np.flatnonzero(self.board[xa:xb, ya:yb] == 0)
+        cells = np.zeros(area, dtype=dtype)
+        slots = np.zeros(area, dtype=dtype)
+        cells[:len(empty)] = empty
+        slots[empty] = np.arange(len(empty))
+        self.lists[region] = (cells, slots)
+        return
+
+    # Marks a cell that was empty as occupied
+    #   The board must already hold the cell's new occupant
+    def take(self, x, y):
+        if not self.on_tile(x, y):
+            return
+
+        region = self.regions.region_of(x, y)
+        self.free[region] -= 1
+        free = self.free[region]
+
+        if self.lists[region] is not None:
+            # Move the last empty cell into the slot of the one that was taken
+            cells, slots = self.lists[region]
+            slot = slots[self.cell_number(region, x, y)]
+            last = cells[free]
+            cells[slot] = last
+            slots[last] = slot
+        elif 2 * free < self.area(region):
+            self.build_list(region)
+        return
+
+    # Marks a cell that was occupied as empty
+    def give(self, x, y):
+        if not self.on_tile(x, y):
+            return
+
+        region = self.regions.region_of(x, y)
+        self.free[region] += 1
+        free = self.free[region]
+
+        if self.lists[region] is not None:
+            if 8 * free > 5 * self.area(region):
+                self.lists[region] = None
+            else:
+                cells, slots = self.lists[region]
+                cell = self.cell_number(region, x, y)
+                cells[free - 1] = cell
+                slots[cell] = free - 1
+        return
+
+    # Returns a random empty cell of a region as an (x, y) tuple, or None if the region is full
+    def pick(self, region):
+        free = self.free[region]
+        if free == 0:
+            return None
+
+        xa, ya, xb, yb = self.bounds[region]
+        if self.lists[region] is not None:
+            cells, slots = self.lists[region]
+            x, y = divmod(int(cells[self.rng.randrange(free)]), yb - ya)
+            return (xa + x, ya + y)
+
+        # The region is at least half empty, so each try lands on an empty cell at least half the time
+        for i in range(self.MAX_TRIES):
+            x = xa + self.rng.randrange(xb - xa)
+            y = ya + self.rng.randrange(yb - ya)
+            if self.board[x, y] == 0:
+                return (x, y)
+
+        empty = np.flatnonzero(self.board[xa:xb, ya:yb] == 0)
+        x, y = divmod(int(empty[self.rng.randrange(len(empty))]), yb - ya)
+        return (xa + x, ya + y)
+
+    # Yields every region index once, starting from a random one
+    def regions_from_random(self):
+        count = len(self.free)
+        start = self.rng.randrange(count)
+        for i in range(count):
+            yield (start + i) % count
+
+
+
+"""
+The Spatial Grid class
+
+A uniform bucket grid laid over the game board that tracks the location of every client of one type
+Used by check_board to find the nearest client without scanning every client on the board
+
+If the grid is given the game's RegionLocks, its buckets line up with the regions: writers must hold the region lock
+of every bucket they change, and nearest reads a consistent snapshot without taking any lock
+Buckets are never changed in place, only replaced, so a reader can always walk the bucket it picked up
+"""
+class SpatialGrid():
+
+    def __init__(self, board_size, cell_size=None, regions=None):
+
+        # Each bucket covers a cell_size x cell_size square of the board
+        self.board_size = board_size
+        self.regions = regions
+        if regions is not None:
+            self.cell_size = regions.region_size
+        else:
+            self.cell_size = cell_size if cell_size is not None else max(1, math.isqrt(board_size))
+        self.num_cells = (board_size + self.cell_size - 1) // self.cell_size
+
+        self.buckets = {}                   # Dict: key = bucket coordinates ((int, int) tuple), value = dict of client name -> (location, insertion number)
+        self.locations = {}                 # Dict: key = client's name (string), value = current location ((int, int) tuple)
+        self.order = {}                     # Dict: key = client's name (string), value = insertion number used to break distance ties
+        self.next_order = itertools.count()
+
+        return
+
+    def __len__(self):
+        return len(self.locations)
+
+    # Returns the coordinates of the bucket that holds the given location
+    def bucket_of(self, x, y):
+        return (x // self.cell_size, y // self.cell_size)
+
+    # Replaces a bucket with a copy that has the client added (or removed, if loc is None)
+    def update_bucket(self, bucket, name, loc):
+        contents = dict(self.buckets.get(bucket, {}))
+        if loc is None:
+            del contents[name]
+        else:
+            contents[name] = (loc, self.order[name])
+
+        if len(contents) == 0:
+            del self.buckets[bucket]
+        else:
+            self.buckets[bucket] = contents
+        return
+
+    # Adds a client to the grid at the given location
+    def insert(self, name, x, y):
+        self.order[name] = next(self.next_order)
+        self.locations[name] = (x, y)
+        self.update_bucket(self.bucket_of(x, y), name, (x, y))
+        return
+
+    # Removes a client from the grid
+    def remove(self, name):
+        x, y = self.locations.pop(name)
+        self.update_bucket(self.bucket_of(x, y), name, None)
+        del self.order[name]
+        return
+
+    # Moves a client that is already in the grid to a new location
+    def move(self, name, x, y):
+        old_x, old_y = self.locations[name]
+        old_bucket = self.bucket_of(old_x, old_y)
+        new_bucket = self.bucket_of(x, y)
+
+        self.locations[name] = (x, y)
+        if old_bucket != new_bucket:
+            self.update_bucket(old_bucket, name, None)
+        self.update_bucket(new_bucket, name, (x, y))
+        return
+
+    # Returns the location of the client nearest to (x, y), or None if the grid is empty
+    #   Ties are broken by insertion order, so the answer matches a linear scan over a dict of the same clients
+    def nearest(self, x, y):
+        if self.regions is None:
+            return self.scan(x, y, {})
+        return self.regions.read(lambda seen: self.scan(x, y, seen))
+
+    # Walks outward from (x, y) ring by ring, recording the version of every region it reads in seen
+    def scan(self, x, y, seen):
+
+        bx, by = self.bucket_of(x, y)
+        max_ring = max(bx, self.num_cells - 1 - bx, by, self.num_cells - 1 - by)
+
+        best = None                         # (squared distance, insertion number, location)
+        for ring in range(max_ring + 1):
+
+            # Every location in this ring is at least (ring - 1) * cell_size + 1 away on one axis
+            # Stop once nothing left to search could be closer than the best match so far
+            if best is not None and ring > 0 and best[0] < ((ring - 1) * self.cell_size + 1)**2:
+                break
+
+            for bucket in self.ring_buckets(bx, by, ring):
+                if self.regions is not None:
+                    region = self.regions.index(bucket[0], bucket[1])
+                    seen[region] = self.regions.versions[region]
+
+                for loc, order in self.buckets.get(bucket, {}).values():
+                    candidate = ((x - loc[0])**2 + (y - loc[1])**2, order, loc)
+                    if best is None or candidate[:2] < best[:2]:
+                        best = candidate
+
+        if best is None:
+            return None
+        return best[2]
+
+    # Yields the in-bounds bucket coordinates that are exactly ring buckets away from (bx, by)
+    def ring_buckets(self, bx, by, ring):
+        if ring == 0:
+            yield (bx, by)
+            return
+
+        for i in range(max(0, bx - ring), min(self.num_cells, bx + ring + 1)):
+            if by - ring >= 0:
+                yield (i, by - ring)
+            if by + ring < self.num_cells:
+                yield (i, by + ring)
+
+        for j in range(max(0, by - ring + 1), min(self.num_cells, by + ring)):
+            if bx - ring >= 0:
+                yield (bx - ring, j)
+            if bx + ring < self.num_cells:
+                yield (bx + ring, j)
+        return
+
+
+
+"""
+The Path History class
+
+The list of locations a client has visited, from its spawn point onwards
+Locations are packed into one typed array of x, y pairs (2 bytes per coordinate on boards up to 32768 across),
+rather than a list of tuples, so a long path costs 4 bytes per step instead of over 100
+Indexing and slicing work like a list of (x, y) tuples, and only build the tuples that are asked for
+"""
+class PathHistory():
+
+    def __init__(self, x, y, board_size):
+        self.coords = array.array('h' if board_size <= 32768 else 'i', (x, y))
+        return
+
+    # Returns the number of locations in the path
+    def __len__(self):
+        return len(self.coords) // 2
+
+    # Returns the location at an index as an (x, y) tuple, or a list of locations for a slice
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [(self.coords[2 * i], self.coords[2 * i + 1]) for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("path index out of range")
+        return (self.coords[2 * index], self.coords[2 * index + 1])
+
+    # Yields every location in the path, oldest first
+    def __iter__(self):
+        coords = self.coords
+        for i in range(0, len(coords) - 1, 2):
+            yield (coords[i], coords[i + 1])
+
+    # Adds a location to the end of the path
+    def append(self, loc):
+        self.coords.append(loc[0])
+        self.coords.append(loc[1])
+        return
+
+    # Returns the whole path packed into bytes
+    def tobytes(self):
+        return self.coords.tobytes()
+
+    # Replaces the path with one packed by tobytes
+    def frombytes(self, data):
+        self.coords = array.array(self.coords.typecode)
+        self.coords.frombytes(data)
+        return
+
+
+
+"""
+The Tick Scheduler class
+
+Lets the server own the game clock, instead of every client sleeping between its own turns
+Each tick the scheduler collects a turn request from the live clients, then plays every collected turn in a fixed order
+(trainers, then pokemon, each in the order they registered) before opening the next tick
+    - tick_interval > 0: each tick lasts tick_interval seconds, and clients that have not asked for a turn by then sit it out
+    - tick_interval = 0: lockstep - the next tick is played as soon as every live client has asked for its turn,
+      or after action_timeout seconds if some client never does
+"""
+class TickScheduler():
+
+    def __init__(self, game, tick_interval=0, action_timeout=1.0):
+
+        # Initialize variables
+        self.game = game
+        self.tick_interval = tick_interval
+        self.action_timeout = action_timeout
+
+        self.tick = 0
+        self.running = False
+        self.pending = {}                   # Dict: key = client's name (string), value = (type, callback) turn request for the next tick
+        self.live_pending = 0               # The number of pending requests that come from clients still on the board
+
+        self.cond = threading.Condition()
+
+        return
+
+    # Starts playing ticks on a background thread
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+        return
+
+    # Stops playing ticks - turns that were still waiting are handed back unplayed
+    def stop(self):
+        with self.cond:
+            self.running = False
+            requests = self.pending
+            self.pending = {}
+            self.live_pending = 0
+            self.cond.notify_all()
+
+        for _, callback in requests.values():
+            callback(None)
+        return
+
+    # Queues a client's turn for the next tick
+    #   callback is called with the client's StepResult once the tick is played, or with None if the scheduler has stopped
+    #   A client that asks again before its turn is played gets the same turn's result, so it never plays twice in a tick
+    def submit(self, name, type, callback):
+        with self.cond:
+            accepted = self.running
+            if accepted:
+                pending = self.pending.get(name)
+                if pending is None:
+                    self.pending[name] = (type, callback)
+                    if name in self.game.trainers or name in self.game.pokemon:
+                        self.live_pending += 1
+                    self.cond.notify_all()
+                else:
+                    first = pending[1]
+
+                    def both(result):
+                        first(result)
+                        callback(result)
+
+                    self.pending[name] = (pending[0], both)
+
+        if not accepted:
+            callback(None)
+        return
+
+    # Queues a client's turn for the next tick, and blocks until it has been played
+    def request_turn(self, name, type):
+        done = threading.Event()
+        result = []
+
+        def finish(step_result):
+            result.append(step_result)
+            done.set()
+
+        self.submit(name, type, finish)
+        done.wait()
+        return result[0]
+
+    # The scheduler loop - collect turn requests, play them, and advance to the next tick
+    def run(self):
+        while self.running:
+
+            with self.cond:
+                deadline = time.monotonic() + (self.tick_interval if self.tick_interval > 0 else self.action_timeout)
+                while self.running:
+
+                    # In lockstep, stop collecting as soon as every live client has asked for its turn
+                    if self.tick_interval == 0 and len(self.pending) > 0 and self.live_pending >= self.game.live_count():
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                if not self.running:
+                    break
+
+                requests = self.pending
+                self.pending = {}
+                self.live_pending = 0
+
+            # Nobody asked for a turn - there is nothing to play this tick
+            if len(requests) == 0:
+                continue
+
+            self.tick += 1
+            results = self.game.play_tick(requests, self.tick)
+            for name, (_, callback) in requests.items():
+                callback(results[name])
+
+            if self.game.status == "over":
+                self.stop()
+
+        return
+
+
+
+"""
+The Target Planner class
+
+Gives every trainer a pokemon of its own to chase, so trainers spread out instead of piling onto whichever pokemon
+happens to be nearest to several of them at once
+Every (trainer, pokemon) pair is ranked by the number of moves the trainer needs to reach the pokemon, then by straight
+line distance, and pairs are matched greedily from the shortest chase up, skipping trainers and pokemon already matched
+Each trainer is first only matched against its few closest pokemon, which keeps planning cheap with hundreds of clients
+Trainers left over once every pokemon has a chaser go after their nearest pokemon, as they would without a planner
+
+The plan is redone every `every` ticks (or rounds of turns, if the server does not own the clock), and early whenever
+a pokemon someone was chasing gets captured
+"""
+class TargetPlanner():
+
+    CANDIDATES = 8                      # The number of closest pokemon each trainer is first matched against
+
+    def __init__(self, game, every=1):
+
+        # Initialize variables
+        self.game = game
+        self.every = every
+
+        self.targets = {}                   # Dict: key = trainer's name (string), value = name of the pokemon it chases (string)
+        self.chased = set()                 # Set of the names of pokemon some trainer is chasing
+        self.planned_at = None              # The tick (or round) of the last plan, None before the first one
+        self.turns = 0                      # The number of trainer turns played, used to count rounds without a server clock
+        self.plans = 0                      # The number of plans made so far
+        self.dirty = False                  # Set when a chased pokemon is captured, so the next turn plans again
+        self.planning = False
+
+        self._lock = threading.Lock()
+
+        return
+
+    # Plans again if the plan is due - tick is the server tick, or None to count rounds of trainer turns instead
+    #   Only one thread plans at a time, and others keep playing with the previous plan in the meantime
+    def maybe_plan(self, tick=None):
+        with self._lock:
+            if tick is None:
+                self.turns += 1
+                tick = self.turns // max(1, len(self.game.trainers))
+
+            due = self.dirty or self.planned_at is None or tick - self.planned_at >= self.every
+            if not due or self.planning:
+                return
+            self.planning = True
+            self.dirty = False
+            self.planned_at = tick
+
+        try:
+            self.plan()
+        finally:
+            self.planning = False
+        return
+
+    # Matches trainers to pokemon from a snapshot of their current locations
+    def plan(self):
+        trainers = list(self.game.trainers.items())
+        pokemon = list(self.game.pokemon.items())
+
+        targets = {}
+        if len(trainers) > 0 and len(pokemon) > 0:
+            t = np.array([loc for _, loc in trainers], dtype=np.int64)
+            p = np.array([loc for _, loc in pokemon], dtype=np.int64)
+            dx = np.abs(t[:, 0, None] - p[None, :, 0])
+            dy = np.abs(t[:, 1, None] - p[None, :, 1])
+
+            # Moves can be diagonal, so a chase takes max(dx, dy) moves - ties go to the closer pokemon in a straight line
+            keys = np.maximum(dx, dy) * (2 * self.game.board_size**2) + dx * dx + dy * dy
+
+            # Match among each trainer's few closest pokemon first, then among everyone still unmatched
+            rows = np.arange(len(trainers))
+            cols = np.arange(len(pokemon))
+            for candidates in (self.CANDIDATES, None):
+                if len(rows) == 0 or len(cols) == 0:
+                    break
+
+                matches = self.match(keys[np.ix_(rows, cols)], candidates)
+                for r, c in matches:
+                    targets[trainers[rows[r]][0]] = pokemon[cols[c]][0]
+
+                rows = np.delete(rows, [r for r, _ in matches])
+                cols = np.delete(cols, [c for _, c in matches])
+
+        self.targets = targets
+        self.chased = set(targets.values())
+        self.plans += 1
+        return
+
+    # Greedily matches the rows of a matrix of chase lengths to its columns, shortest first, and returns the (row, column) pairs
+    #   With candidates given, each row only considers that many of its shortest columns, so some rows may be left over
+    @staticmethod
+    def match(keys, candidates=None):
+        num_rows, num_cols = keys.shape
+        if candidates is not None and candidates < num_cols:
+            near = np.argpartition(keys, candidates - 1, axis=1)[:, :candidates]
+            keys = np.take_along_axis(keys, near, axis=1)
+            near = near.tolist()
+        else:
+            near = None
+
+        matched_rows = set()
+        matched_cols = set()
+        matches = []
+        wanted = min(num_rows, num_cols)
+
+        for pair in np.argsort(keys, axis=None, kind='stable').tolist():
+            r, j = divmod(pair, keys.shape[1])
+            c = near[r][j] if near is not None else j
+            if r in matched_rows or c in matched_cols:
+                continue
+
+            matched_rows.add(r)
+            matched_cols.add(c)
+            matches.append((r, c))
+            if len(matches) == wanted:
+                break
+
+        return matches
+
+    # Returns the location of the pokemon a trainer was assigned, or None if it has none or its pokemon is gone
+    def target_of(self, name):
+        pokemon = self.targets.get(name)
+        if pokemon is None:
+            return None
+        return self.game.pokemon.get(pokemon)
+
+    # Called when a pokemon is captured - if someone was chasing it, the next turn plans again
+    def captured(self, pokemon):
+        if pokemon in self.chased:
+            self.dirty = True
+        return
+
+
+
+"""
+The Flee Field class
+
+Lets every pokemon pick its flee move by looking up its neighbouring cells, instead of searching for its nearest trainer
+Once per tick (or round of pokemon turns, if the server does not own the clock), the number of moves the nearest
+trainer needs to reach every cell of the board is worked out in one pass, and each pokemon steps to the neighbouring
+cell a trainer would take longest to reach
+
+Running straight away from the single nearest trainer walks a pokemon into walls and corners, where the move gets
+clamped back onto the board and the pokemon stands still. The field takes every trainer into account, and among equally
+safe cells a pokemon prefers the one furthest from the edges of the board, so it slides along a wall instead of into a corner
+"""
+class FleeField():
+
+    MOVES = [(0, 0)] + [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)]
+    MAX_BOARD_SIZE = 4000               # The largest board a field is built for - building one takes time in every tick
+
+    def __init__(self, game):
+
+        # Initialize variables
+        self.game = game
+
+        size = game.board_size
+        self.dtype = np.int16 if size < np.iinfo(np.int16).max else np.int32
+        self.distances = None               # Array of moves from the nearest trainer to every cell, None before the first build
+        self.spare = None                   # The array the next build is written to, kept between builds so it is not allocated again
+        self.pairs = np.empty(max(size - 1, 1), dtype=self.dtype)
+        self.nearby = np.empty(size, dtype=self.dtype)
+        self.steps = np.arange(size, dtype=self.dtype)
+                                            # Buffers reused by every build
+        self.built_at = None                # The tick (or round) of the last build
+        self.turns = 0                      # The number of pokemon turns played, used to count rounds without a server clock
+        self.builds = 0                     # The number of times the field was built
+        self.building = False
+
+        self._lock = threading.Lock()
+
+        return
+
+    # Builds the field again if it is from an earlier tick - tick is the server tick, or None to count rounds of pokemon turns
+    #   Only one thread builds at a time, and others keep using the previous field in the meantime
+    def maybe_build(self, tick=None):
+        with self._lock:
+            if tick is None:
+                self.turns += 1
+                tick = self.turns // max(1, len(self.game.pokemon))
+
+            if tick == self.built_at or self.building:
+                return
+            self.building = True
+            self.built_at = tick
+
+        try:
+            self.build()
+        finally:
+            self.building = False
+        return
+
+    # Works out the moves from the nearest trainer to every cell, from a snapshot of the trainers' current locations
+    #   A move can be diagonal, so this is the chessboard distance, found in place on the board in two passes:
+    #   first along every row, which gives the distance to the nearest trainer in the same row, then down and back up
+    #   the board, where a cell is one move further than the nearest of the three cells next to it in the row before
+    #   The new field is written to the spare array and swapped in, so pokemon keep reading the last one until it is done
+    def build(self):
+        size = self.game.board_size
+        trainers = list(self.game.trainers.values())
+        if len(trainers) == 0:
+            self.distances = None
+            return
+
+        field = self.spare if self.spare is not None else np.empty((size, size), dtype=self.dtype)
+        field.fill(size)
+        t = np.array(trainers, dtype=np.intp)
+        field[t[:, 0], t[:, 1]] = 0
+
+        # Along every row, both ways
+        steps = self.steps
+        for view in (field, field[:, ::-1]):
+            np.subtract(view, steps, out=view)
+            np.minimum.accumulate(view, axis=1, out=view)
+            np.add(view, steps, out=view)
+
+        # Down the board, then back up it
+        pairs, nearby = self.pairs, self.nearby
+        if size > 1:
+            for rows in (range(1, size), range(size - 2, -1, -1)):
+                step = 1 if rows.step > 0 else -1
+                for x in rows:
+                    before = field[x - step]
+                    np.minimum(before[:-1], before[1:], out=pairs)
+                    np.minimum(pairs[:-1], pairs[1:], out=nearby[1:-1])
+                    nearby[0] = pairs[0]
+                    nearby[-1] = pairs[-1]
+                    nearby += 1
+                    np.minimum(field[x], nearby, out=field[x])
+
+        self.spare = self.distances
+        self.distances = field
+        self.builds += 1
+        return
+
+    # Returns the (dx, dy) move that takes a pokemon at (x, y) furthest from every trainer, or None if there is no field yet
+    #   Cells held by other pokemon are skipped, and (0, 0) means the pokemon is best off where it is
+    def best_move(self, name, x, y):
+        distances = self.distances
+        if distances is None:
+            return None
+
+        size = self.game.board_size
+        best = None
+        best_key = None
+        for dx, dy in self.MOVES:
+            nx, ny = x + dx, y + dy
+            if nx < 0 or ny < 0 or nx >= size or ny >= size:
+                continue
+            occupant = self.game.pokemon_cells.get((nx, ny))
+            if occupant is not None and occupant != name:
+                continue
+
+            # Safest cell first, then the one with the most room to the edges of the board
+            key = (int(distances[nx, ny]), min(nx, ny, size - 1 - nx, size - 1 - ny))
+            if best_key is None or key > best_key:
+                best, best_key = (dx, dy), key
+
+        return best
+
+
+"""
+The Board Renderer class
+
+Draws the game board to the terminal, redrawing only the cells that changed since the last frame
+The board is an array of icon ids, which are only turned into emojis here, through a table built once
+Each cell is drawn as '|' + emoji + ' ', four columns wide, so a changed cell can be reached directly by its column
+Action messages are drawn under the board, and trimmed so the whole frame fits on the screen
+Every frame is built up in memory and sent to the terminal in one write
+"""
+class BoardRenderer():
+
+    # shortcodes is the table of emoji shortcodes, indexed by the icon ids the board holds
+    def __init__(self, board_size, shortcodes=(), out=None):
+
+        self.board_size = board_size
+        self.out = out if out is not None else sys.stdout
+
+        # Lookup table of icon id -> glyph, so no frame calls emoji.emojize
+        self.glyphs = [emoji.emojize(code) for code in shortcodes]
+                                            # List of emojis drawn in the terminal, indexed by icon id ([string])
+
+        self.frame = None                   # The board as it was last drawn (array of icon ids), None until the first frame
+        self.lines_below = 0                # The number of lines drawn under the board in the last frame
+
+        return
+
+    # Draws one frame from a snapshot of the board, and the action messages that happened since the last frame
+    def draw(self, board, messages):
+        glyphs = self.glyphs
+        buf = []
+
+        if self.frame is None:
+            # First frame - draw every cell
+            for row in board.tolist():
+                buf.append(''.join('|' + glyphs[icon] + ' ' for icon in row) + '|\n')
+
+        else:
+            # Move up to the top of the board, then down to each changed row and across to each changed cell
+            buf.append(f'\033[{self.board_size + self.lines_below}A')
+            line = 0
+            changed = board != self.frame
+            for i in np.flatnonzero(changed.any(axis=1)).tolist():
+                if i > line:
+                    buf.append(f'\033[{i - line}B')
+                    line = i
+                for j in np.flatnonzero(changed[i]).tolist():
+                    buf.append(f'\033[{4 * j + 2}G' + glyphs[board[i, j]])
+
+            # Back to the line under the board
+            if self.board_size > line:
+                buf.append(f'\033[{self.board_size - line}B')
+            buf.append('\r')
+
+        # Replace the old action messages with the new ones, keeping the frame on one screen
+        columns, rows = shutil.get_terminal_size()
+        room = max(1, rows - self.board_size - 1)
+        if len(messages) > room:
+            messages = messages[:room - 1] + [f"... and {len(messages) - room + 1} more"]
+
+        buf.append('\033[J')
+        for msg in messages:
+            buf.append(msg[:columns - 2] + '\n')
+
+        self.out.write(''.join(buf))
+        self.out.flush()
+
+        self.frame = board
+        self.lines_below = len(messages)
+
+        return
+
+
+
+"""
+The Action Log class
+
+Records every action taken in the game as a row of integers - (tick, actor, kind, from x, from y, to x, to y, target) -
+in a compact array, and only turns rows into text when they are printed
+Only the last window rows are kept in memory: older rows are appended to a file, and read back when the log is exported
+Rows in the file never change, so a checkpoint only needs the rows still in memory and how far the file had got
+Client names are stored once in a table, and rows refer to them by their index in it
+"""
+class ActionLog():
+
+    KINDS = ("connect", "move", "capture")
+    FIELDS = 8
+    ROW_SIZE = array.array('i').itemsize * FIELDS
+                                        # The number of bytes a row takes up, in memory and in the file
+
+    def __init__(self, window=4096, path=None):
+
+        self.window = window
+        self.path = path                    # The file rows are written out to, None to use a temporary file
+
+        self.rows = array.array('i')        # The rows still in memory, FIELDS ints each
+        self.spilled = 0                    # The number of rows written out to the file
+        self.spill = None                   # The file rows are written out to, opened on the first write
+        self.closed = False                 # Set once the log is closed - a closed log records nothing more
+
+        self.names = []                     # List of client names, indexed by actor id ([string])
+        self.glyphs = []                    # List of client emojis, indexed by actor id ([string])
+        self.ids = {}                       # Dict: key = client's name (string), value = actor id (int)
+
+        self._lock = threading.Lock()
+
+        return
+
+    # Returns the number of rows recorded so far
+    def __len__(self):
+        return self.spilled + len(self.rows) // self.FIELDS
+
+    # Returns the actor id of a client, giving it one the first time it is seen
+    #   Callers must hold self._lock
+    def actor(self, name, icon):
+        actor = self.ids.get(name)
+        if actor is None:
+            actor = len(self.names)
+            self.ids[name] = actor
+            self.names.append(name)
+            self.glyphs.append(emoji.emojize(icon.strip()))
+        return actor
+
+    # Records one action and returns its row
+    #   Calls still in flight when the log is closed get their row back, but it is not kept
+    def record(self, tick, kind, name, icon, start=(-1, -1), end=(-1, -1), target=None):
+        with self._lock:
+            row = (tick, self.actor(name, icon), self.KINDS.index(kind), start[0], start[1], end[0], end[1],
+                   self.ids.get(target, -1))
+            if self.closed:
+                return row
+            self.rows.extend(row)
+
+            # Write the window out once it is full
+            if len(self.rows) >= self.window * self.FIELDS:
+                if self.spill is None:
+                    self.spill = open(self.path, 'w+b', buffering=0) if self.path is not None else tempfile.TemporaryFile(buffering=0)
+                self.spill.write(self.rows.tobytes())
+                self.spilled += len(self.rows) // self.FIELDS
+                self.rows = array.array('i')
+
+        return row
+
+    # Yields every row recorded so far, oldest first, reading the written out rows back in chunks
+    def records(self, chunk=4096):
+        with self._lock:
+            spilled = self.spilled
+            rows = array.array('i', self.rows)
+
+        size = self.ROW_SIZE
+        for start in range(0, spilled, chunk):
+            block = array.array('i')
+            block.frombytes(os.pread(self.spill.fileno(), min(chunk, spilled - start) * size, start * size))
+            for i in range(0, len(block), self.FIELDS):
+                yield tuple(block[i:i + self.FIELDS])
+
+        for i in range(0, len(rows), self.FIELDS):
+            yield tuple(rows[i:i + self.FIELDS])
+
+    # Returns the message of a row, starting with its tick if with_tick is set and the server owns the clock
+    def format(self, row, with_tick=False):
+        tick, actor, kind, fx, fy, tx, ty, target = row
+        name = self.names[actor]
+        glyph = self.glyphs[actor]
+
+        if self.KINDS[kind] == "connect":
+            msg = f"{name} connected to the server as {glyph}"
+        elif self.KINDS[kind] == "move":
+            msg = f"{name} ({glyph}) moved to ({tx}, {ty}) from ({fx}, {fy})"
+        else:
+            msg = f"{name} ({glyph}) has captured {self.names[target]}"
+
+        if with_tick and tick > 0:
+            msg = f"Tick {tick}: " + msg
+        return msg
+
+    # Returns the number of rows written out so far, a copy of the rows still in memory, and the actor table
+    def mark(self):
+        with self._lock:
+            return self.spilled, self.rows.tobytes(), list(self.names), list(self.glyphs)
+
+    # Moves the rows written out so far to the file at path, and keeps writing rows out there
+    #   Only copies anything the first time, when the rows were going to a temporary file
+    def keep_at(self, path):
+        with self._lock:
+            if self.path == path:
+                return
+
+            spill = open(path, 'w+b', buffering=0)
+            if self.spill is not None:
+                self.spill.seek(0)
+                shutil.copyfileobj(self.spill, spill)
+                self.spill.close()
+
+            self.spill = spill
+            self.path = path
+        return
+
+    # Loads the rows still in memory when a checkpoint was taken, packed as bytes, with the actor table they refer to, into an empty log
+    #   The first spilled rows are taken from the log's file, and anything written to it after them is dropped
+    def load(self, names, glyphs, data, spilled=0):
+        with self._lock:
+            self.names = list(names)
+            self.glyphs = list(glyphs)
+            self.ids = {name: actor for actor, name in enumerate(self.names)}
+
+            if spilled > 0:
+                self.spill = open(self.path, 'r+b', buffering=0)
+                self.spill.truncate(spilled * self.ROW_SIZE)
+                self.spill.seek(0, os.SEEK_END)
+                self.spilled = spilled
+
+            self.rows = array.array('i')
+            self.rows.frombytes(data)
+        return
+
+    # Yields the message of every row recorded so far, oldest first
+    def lines(self):
+        for row in self.records():
+            yield self.format(row, with_tick=True)
+
+    # Closes the file rows were written out to
+    def close(self):
+        with self._lock:
+            self.closed = True
+            if self.spill is not None:
+                self.spill.close()
+        return
+
+
+
+"""
+The Metrics class
+
+Counts the calls to every RPC and keeps a histogram of how long they took, with fixed bucket bounds in seconds
+Can render them, along with any gauges passed in, in the Prometheus text format
+"""
+class Metrics():
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.last_call = self.start_time    # When the last RPC finished, for telling abandoned games apart
+        self.rpcs = {}                      # Dict: key = RPC name (string), value = [calls, total seconds, count per bucket (the last one is +Inf)]
+        self._lock = threading.Lock()
+        return
+
+    # Records one call to an RPC that took the given number of seconds
+    def observe(self, name, seconds):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            rpc = self.rpcs.get(name)
+            if rpc is None:
+                rpc = [0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+                self.rpcs[name] = rpc
+            rpc[0] += 1
+            rpc[1] += seconds
+            rpc[2][bucket] += 1
+            self.last_call = time.monotonic()
+        return
+
+    # Returns a copy of every RPC's [calls, total seconds, count per bucket], by name
+    def snapshot(self):
+        with self._lock:
+            return {name: [calls, total, list(buckets)] for name, (calls, total, buckets) in self.rpcs.items()}
+
+    # Returns the number of seconds since the metrics were created
+    def uptime(self):
+        return time.monotonic() - self.start_time
+
+    # Returns the number of seconds since the last RPC finished, or since the metrics were created if none has
+    def idle(self):
+        return time.monotonic() - self.last_call
+
+    # Returns the RPC histograms and the gauges in the Prometheus text format
+    #   Gauges whose name ends in _total are reported as counters
+    def prometheus(self, gauges):
+        lines = ["# HELP pokemonou_rpc_duration_seconds Time taken to serve each RPC",
+                 "# TYPE pokemonou_rpc_duration_seconds histogram"]
+
+        for name, (calls, total, buckets) in sorted(self.snapshot().items()):
+            counts = itertools.accumulate(buckets)
+            for bound, count in zip(self.BUCKETS + ("+Inf",), counts):
+                lines.append(f'pokemonou_rpc_duration_seconds_bucket{{method="{name}",le="{bound}"}} {count}')
+            lines.append(f'pokemonou_rpc_duration_seconds_sum{{method="{name}"}} {total}')
+            lines.append(f'pokemonou_rpc_duration_seconds_count{{method="{name}"}} {calls}')
+
+        for name, value in gauges.items():
+            lines.append(f"# TYPE pokemonou_{name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"pokemonou_{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+
 """
 The Pokemon OU Game class
 
@@ -24,17 +1148,42 @@ Some functions are called only by the server machine
 """
 class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
 
-    def __init__(self, board_size, total_pkmn):
+    PATH_CHUNK = 500                    # The most locations show_path puts in one message
+    CHECKPOINT_VERSION = 2              # Bumped whenever the layout of a checkpoint changes
+    FLEE_STRATEGIES = ("nearest", "field")
+
+    # tile, if given, is the (x0, y0, x1, y1) part of the board this game owns as one shard of a larger board
+    #   New clients only spawn inside the tile, and the shard router hands clients off before they leave it
+    # seed, if given, makes every random choice of the game (spawn points and emojis) the same on every run
+    # plan_every, if given, turns on a TargetPlanner that gives every trainer its own pokemon to chase, redone every plan_every ticks
+    # flee picks how pokemon run from trainers - "nearest" runs straight away from the nearest trainer, "field" uses a FleeField
+    # num_trainers, if given, holds the game at a start barrier until that many trainers and every pokemon have connected
+    # log_path, if given, is the file older actions are written out to, instead of a temporary file
+    def __init__(self, board_size, total_pkmn, tick_interval=None, region_size=None, tile=None, seed=None, plan_every=None,
+                 flee="nearest", num_trainers=None, log_path=None):
 
         # Initialize variables
         self.status = "active"
+        self.ended = False                  # Set once the game has been ended early, before every pokemon was captured
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.rng = random.Random(self.seed)
 
         self.board_size = board_size
-        self.game_board = [[":seedling:" for i in range(self.board_size)] for j in range(self.board_size)]
+        self.game_board = np.zeros((self.board_size, self.board_size), dtype=np.uint16)
+                                            # Array of the icon id drawn on every cell - 0 for an empty cell (see icon_table)
+
+        # Lock variables
+        #   Locks are always taken in this order: board regions (lowest index first), then _game_lock, then _stream_lock
+        self.regions = RegionLocks(self.board_size, region_size)
+                                            # Guards every cell of the board, and everything about the clients standing on it
+        self._game_lock = threading.Lock()  # Guards registration, emoji allocation, and the capture counter
+        self._stream_lock = threading.Lock()
+                                            # Guards the lists of open event streams
 
         self.trainers = {}                  # Dict: key = trainer's name (string), value = current location ((int, int) tuple)
         self.trainer_pokedexes = {}         # Dict: key = trainer's name (string), value = list of pokemon ([string])
-        self.trainer_paths = {}             # Dict: key = trainer's name (string), value = list of locations visited ([(int, int)])
+        self.owners = {}                    # Dict: key = captured pokemon's name (string), value = trainer that caught it (string)
+        self.trainer_paths = {}             # Dict: key = trainer's name (string), value = locations visited (PathHistory)
         self.people_emojis = []             # List of emojis for trainers to use ([string]) - https://emojipedia.org/people/ 
         self.used_people_emojis = []        # List of booleans corresponding to people_emojis that has True if that emoji has been used
 
@@ -42,17 +1191,56 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
         self.num_pkmn = total_pkmn          # The int number of total pokemon that will be added
                                             # Used so game cannot end prematurely before all Pokemon are added
         self.pokemon = {}                   # Dict: key = pokemon's name (string), value = current location ((int, int) tuple)
-        self.pokemon_paths = {}             # Dict: key = pokemon's name (string), value = list of locations visited ([(int, int)])
+        self.pokemon_paths = {}             # Dict: key = pokemon's name (string), value = locations visited (PathHistory)
         self.animal_emojis = []             # List of emojis for pokemon to use ([string]) - https://emojipedia.org/nature/
         self.used_animal_emojis = []        # List of booleans telling which animal emojis have been used
 
-        self.action_list = []               # A list of all the actions that clients have taken in the game so far
-        self.current_actions = []           # A list of the current actions that have not been output yet
-
-        self.last_output_len = 0
-
-        # Lock variables
-        self._key_lock = threading.Lock()
+        # Spatial indexes of both populations, kept in step with self.trainers and self.pokemon
+        self.trainer_grid = SpatialGrid(self.board_size, regions=self.regions)
+        self.pokemon_grid = SpatialGrid(self.board_size, regions=self.regions)
+
+        # Occupancy maps - the authoritative record of who stands on each cell
+        # A cell holds at most one trainer and at most one pokemon at a time
+        self.trainer_cells = {}             # Dict: key = location ((int, int) tuple), value = trainer's name (string)
+        self.pokemon_cells = {}             # Dict: key = location ((int, int) tuple), value = pokemon's name (string)
+        self.tile = tile
+        self.free_cells = FreeCells(self.regions, self.game_board, tile, self.rng)
+                                            # The empty cells of every region, where new clients can spawn
+        self.icons = {}                     # Dict: key = client's name (string), value = emoji assigned to that client (string)
+        self.reconnecting = set()           # Set of the names of clients restored from a checkpoint that have not connected again yet
+        self.agents = [(None, None)]        # List of (name, type) tuples, indexed by the agent id each client was given - 0 is never given
+        self.agent_ids = {}                 # Dict: key = client's name (string), value = the agent id it was given (int)
+
+        self.action_log = ActionLog(path=log_path)
+                                            # Every action that clients have taken in the game so far
+        self.current_actions = collections.deque(maxlen=1000)
+                                            # The latest actions (rows of action_log) and messages that have not been output yet
+
+        # Event streams opened by clients through subscribe
+        self.subscribers = {}               # Dict: key = client's name (string), value = list of event queues ([AsyncEventQueue])
+        self.position_subscribers = {"trainer": [], "pokemon": []}
+                                            # Dict: key = client type (string), value = queues that also want opponent positions
+
+        # The server-owned game clock - None lets every client play its turns at its own pace
+        self.scheduler = TickScheduler(self, tick_interval) if tick_interval is not None else None
+
+        # Picks which pokemon each trainer chases - None has every trainer chase its nearest pokemon
+        self.planner = TargetPlanner(self, plan_every) if plan_every is not None else None
+
+        # Picks where each pokemon runs to - None has every pokemon run straight away from its nearest trainer
+        if flee == "field" and board_size > FleeField.MAX_BOARD_SIZE:
+            raise ValueError(f"flee fields are only built for boards of up to {FleeField.MAX_BOARD_SIZE} spots across")
+        self.flee_field = FleeField(self) if flee == "field" else None
+
+        # The start barrier - turns and moves wait until every expected client has connected, if num_trainers is given
+        self.num_trainers = num_trainers
+        self.started = threading.Event()    # Set once the game has started
+        self.start_callbacks = []           # Functions to call once the game starts
+        if num_trainers is None:
+            self.started.set()
+
+        # Call counts and latencies of every RPC, filled in by the servicer
+        self.metrics = Metrics()
 
         # Initialize people and animal emoji lists
         # Will read people_emoji_list.txt and animal_emoji_list.txt to get all used emojis
@@ -60,16 +1248,31 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
             lines = p.readlines()
 
             for i in range(len(lines)):
-                self.people_emojis.append(lines[i])
+                self.people_emojis.append(lines[i].strip())
                 self.used_people_emojis.append(False)
 
         with open('animal_emoji_list.txt', 'r') as a:
             lines = a.readlines()
 
             for i in range(len(lines)):
-                self.animal_emojis.append(lines[i])
+                self.animal_emojis.append(lines[i].strip())
                 self.used_animal_emojis.append(False)
 
+        # Shuffled lists of the emojis nobody is using yet, so each new client just takes the last one
+        self.free_people_emojis = list(range(len(self.people_emojis)))
+        self.free_animal_emojis = list(range(len(self.animal_emojis)))
+        self.rng.shuffle(self.free_people_emojis)
+        self.rng.shuffle(self.free_animal_emojis)
+
+        # Every icon that can be drawn on the board, by the id game_board holds for it
+        self.icon_table = [":seedling:"] + self.people_emojis + self.animal_emojis
+                                            # List of emoji shortcodes, indexed by icon id ([string])
+        self.icon_ids = {code: i for i, code in enumerate(self.icon_table)}
+                                            # Dict: key = emoji shortcode (string), value = its icon id (int)
+
+        # Draws the board on the server's terminal
+        self.renderer = BoardRenderer(self.board_size, self.icon_table)
+
         return
 
 
@@ -77,42 +1280,408 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
     Server Functions
     """
 
+    # Returns the current value of every game gauge, by name
+    def gauges(self):
+        regions = self.regions
+        return {
+            "uptime_seconds": round(self.metrics.uptime(), 3),
+            "live_clients": self.live_count(),
+            "trainers": len(self.trainers),
+            "free_pokemon": len(self.pokemon),
+            "captures_total": self.capture_counter,
+            "captures_per_second": round(self.capture_counter / max(self.metrics.uptime(), 1e-9), 3),
+            "started": int(self.started.is_set()),
+            "ticks_total": self.scheduler.tick if self.scheduler is not None else 0,
+            "plans_total": self.planner.plans if self.planner is not None else 0,
+            "flee_fields_total": self.flee_field.builds if self.flee_field is not None else 0,
+            "action_log_rows": len(self.action_log),
+            "region_lock_waits_total": sum(regions.waits),
+            "region_lock_wait_seconds_total": round(sum(regions.wait_times), 6),
+            "region_lock_holds_total": sum(regions.holds),
+            "region_lock_hold_seconds_total": round(sum(regions.hold_times), 6),
+        }
+
+    # Ends the game early - stops its clock and tells every open stream the game is over
+    #   The action log stays open, so the game can still be printed and checkpointed while its clients wrap up
+    def end(self):
+        self.ended = True
+        self.update_status()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+        with self._stream_lock:
+            for queues in self.subscribers.values():
+                for events in queues:
+                    events.put(pokemonou_pb2.Event(kind="over"))
+        return
+
+    # Ends the game if it is still going, and closes the action log - only called once the game is being thrown away
+    def close(self):
+        if not self.ended:
+            self.end()
+        self.action_log.close()
+        return
+
+    # Writes the metrics to a file in the Prometheus text format
+    #   The file is replaced in one step, so a reader never sees it half written
+    def dump_metrics(self, path):
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.metrics.prometheus(self.gauges()))
+        os.replace(path + '.tmp', path)
+        return
+
+    # Writes a snapshot of the whole game to a file, and returns the number of actions it covers
+    #   Every region lock is held while the state is copied, so the snapshot is of a single moment of the game
+    #   The file is replaced in one step, so a crash part-way through a write never loses the last good snapshot
+    #   Clients with an emoji but no spot yet (registering right now, or being handed to another shard) are left out,
+    #   and connect as new clients after a restore
+    #   Actions already written out are not copied - the action log keeps appending them to the file at checkpoint_log(path),
+    #   and the snapshot only holds how far that file had got, along with the actions still in memory
+    def checkpoint(self, path):
+        self.action_log.keep_at(self.checkpoint_log(path))
+
+        with self.regions.hold_all():
+            with self._game_lock:
+                state = {
+                    "version": self.CHECKPOINT_VERSION,
+                    "board_size": self.board_size,
+                    "num_pkmn": self.num_pkmn,
+                    "seed": self.seed,
+                    "ended": self.ended,
+                    "capture_counter": self.capture_counter,
+                    "tick": self.scheduler.tick if self.scheduler is not None else 0,
+                    "icons": {name: icon for name, icon in self.icons.items()
+                              if name in self.trainers or name in self.pokemon or name in self.owners},
+                    "trainers": dict(self.trainers),
+                    "pokemon": dict(self.pokemon),
+                    "pokedexes": {name: list(pokedex) for name, pokedex in self.trainer_pokedexes.items()},
+                    "owners": dict(self.owners),
+                    "trainer_paths": {name: path.tobytes() for name, path in self.trainer_paths.items()},
+                    "pokemon_paths": {name: path.tobytes() for name, path in self.pokemon_paths.items()},
+                }
+                spilled, rows, names, glyphs = self.action_log.mark()
+
+        state["actors"] = (names, glyphs)
+        state["log_offset"] = spilled * ActionLog.ROW_SIZE
+        state["actions"] = rows
+
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+        return spilled + len(rows) // ActionLog.ROW_SIZE
+
+    # Returns the path of the action log file kept next to a checkpoint file
+    @staticmethod
+    def checkpoint_log(path):
+        return path + '.log'
+
+    # Returns the snapshot stored in a checkpoint file
+    @staticmethod
+    def read_checkpoint(path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get("version") != PokemonOUGame.CHECKPOINT_VERSION:
+            raise ValueError(f"{path} is not a version {PokemonOUGame.CHECKPOINT_VERSION} checkpoint")
+        return state
+
+    # Returns every action a checkpoint covers, packed as bytes - the ones in its log file up to its offset, then the ones it holds
+    @staticmethod
+    def read_checkpoint_actions(path, state):
+        if state["log_offset"] == 0:
+            return state["actions"]
+
+        with open(PokemonOUGame.checkpoint_log(path), 'rb') as f:
+            return f.read(state["log_offset"]) + state["actions"]
+
+    # Loads a snapshot from checkpoint into this game, which must be new and have the same board size
+    #   The game's log_path must be the checkpoint's log file, which holds the actions the snapshot does not
+    #   Every client in the snapshot has to connect again, and gets back its emoji and location when it does
+    def restore(self, state):
+        self.ended = state["ended"]
+        self.capture_counter = state["capture_counter"]
+        if self.scheduler is not None:
+            self.scheduler.tick = state["tick"]
+
+        self.icons = dict(state["icons"])
+        self.owners = dict(state["owners"])
+        self.trainer_pokedexes = {name: list(pokedex) for name, pokedex in state["pokedexes"].items()}
+        for paths, packed in ((self.trainer_paths, state["trainer_paths"]), (self.pokemon_paths, state["pokemon_paths"])):
+            for name, data in packed.items():
+                paths[name] = PathHistory(0, 0, self.board_size)
+                paths[name].frombytes(data)
+
+        # Put every client still on the board back on its spot
+        for type, clients, paths in (("trainer", state["trainers"], self.trainer_paths), ("pokemon", state["pokemon"], self.pokemon_paths)):
+            for name, (x, y) in clients.items():
+                with self.regions.hold((x, y)):
+                    self.add_client(type, name, x, y, paths[name], self.trainer_pokedexes.get(name))
+
+        # Emojis of restored clients stay theirs
+        in_use = set(self.icons.values())
+        for emojis, used, free in ((self.people_emojis, self.used_people_emojis, self.free_people_emojis),
+                                   (self.animal_emojis, self.used_animal_emojis, self.free_animal_emojis)):
+            for i, e in enumerate(emojis):
+                used[i] = e in in_use
+            free[:] = [i for i in free if not used[i]]
+
+        self.reconnecting = set(self.icons)
+        self.action_log.load(*state["actors"], state["actions"], state["log_offset"] // ActionLog.ROW_SIZE)
+        self.update_status()
+
+        # A restored game was already under way, so it does not wait at the start barrier again
+        self.start()
+
+        self.current_actions.append(f"Restored {len(self.icons)} clients and {len(self.action_log)} actions from a checkpoint")
+        return
+
     # Prints all of the actions that every client has taken so far
+    #   Messages are written out in batches, so long games do not need one print call per action
     def actions(self):
-        for action in self.action_list:
-            print(action)
+        lines = self.action_log.lines()
+        while True:
+            batch = list(itertools.islice(lines, 1000))
+            if len(batch) == 0:
+                break
+            sys.stdout.write('\n'.join(batch) + '\n')
+        sys.stdout.flush()
         return
 
     # Prints the current state of the board, and all the actions that have been taken in this turn
+    #   Only the cells that changed since the last call are redrawn
     def print_board(self):
+        current_actions, self.current_actions = self.current_actions, collections.deque(maxlen=1000)
+        messages = [self.action_log.format(msg) if isinstance(msg, tuple) else msg for msg in current_actions]
+        self.renderer.draw(self.snapshot_board(), messages)
+        return
 
-        # Clear the screen
-        LINE_UP = '\033[1A'
-        LINE_CLEAR = '\x1b[2K'
-        for i in range(self.last_output_len):
-            print(LINE_UP, end=LINE_CLEAR)
-
-        # Print the actual board
-        for i in range(self.board_size):
-            for j in range(self.board_size):    
-                print('|' + emoji.emojize(self.game_board[i][j].strip()) + ' ', end='')
+    # Returns a copy of game_board that no writer was part-way through changing, without blocking writers
+    def snapshot_board(self):
+
+        def read(seen):
+            for r in range(len(self.regions.versions)):
+                seen[r] = self.regions.versions[r]
+            return self.game_board.copy()
+
+        return self.regions.read(read)
+
+    # Redraws a single cell of game_board from the occupancy maps, and keeps the counts of free_cells up to date
+    #   A trainer is drawn over a pokemon that shares its cell
+    #   Callers must hold the region lock of the cell
+    def repaint(self, x, y):
+        occupant = self.trainer_cells.get((x, y), self.pokemon_cells.get((x, y)))
+        was_empty = self.game_board[x, y] == 0
+        if occupant is None:
+            self.game_board[x, y] = 0
+            if not was_empty:
+                self.free_cells.give(x, y)
+        else:
+            self.game_board[x, y] = self.icon_ids[self.icons[occupant]]
+            if was_empty:
+                self.free_cells.take(x, y)
+        return
 
-                if j == self.board_size-1:
-                    print('|', end='')
+    # Updates and returns the status of the game
+    #   The game is over once every pokemon has been added and captured
+    def update_status(self):
+        if self.ended or (len(self.pokemon) == 0 and self.capture_counter == self.num_pkmn):
+            self.status = "over"
+        else:
+            self.status = "active"
+        return self.status
+
+    # Returns the number of clients still on the board
+    def live_count(self):
+        return len(self.trainers) + len(self.pokemon)
+
+    # Calls callback once the game has started - right away if it already has
+    #   callback may be called from any thread, so it must not block
+    def when_started(self, callback):
+        with self._game_lock:
+            waiting = not self.started.is_set()
+            if waiting:
+                self.start_callbacks.append(callback)
+
+        if not waiting:
+            callback()
+        return
 
-            # Newline
-            print()
+    # Starts the game if every expected client has connected, or right away if force is set
+    def start(self, force=True):
+        with self._game_lock:
+            if self.started.is_set():
+                return
+            if not force and (len(self.trainers) < self.num_trainers or len(self.pokemon) < self.num_pkmn):
+                return
+            self.started.set()
+            callbacks = self.start_callbacks
+            self.start_callbacks = []
+
+        self.current_actions.append(f"The game has started with {self.live_count()} clients")
+        for callback in callbacks:
+            callback()
+        return
 
-        # Print all of the action messages for this turn
-        for msg in self.current_actions:
-            print(msg)
+    # Returns the location of the nearest client of the opposite type, or None if there are none
+    #   Reads a consistent snapshot of the spatial index without locking
+    def nearest_opponent(self, type, x, y):
+        if type == "trainer":
+            return self.pokemon_grid.nearest(x, y)
+        elif type == "pokemon":
+            return self.trainer_grid.nearest(x, y)
+        return None
+
+    # Returns the location of the pokemon a trainer should chase, or None if there are none
+    #   With a planner, this is the trainer's assigned pokemon, and otherwise (or if it has none) the nearest one
+    def chase_target(self, name, x, y):
+        if self.planner is not None:
+            if self.scheduler is None:
+                self.planner.maybe_plan()
+            target = self.planner.target_of(name)
+            if target is not None:
+                return target
+        return self.nearest_opponent("trainer", x, y)
+
+    # Returns the location a pokemon should run straight away from, or None if there are no trainers
+    #   With a flee field, this is a point placed so that running away from it takes the pokemon to its best neighbouring cell
+    def flee_from(self, name, x, y, tick=None):
+        if self.flee_field is not None:
+            self.flee_field.maybe_build(tick)
+            move = self.flee_field.best_move(name, x, y)
+            if move is not None:
+                return (x - move[0], y - move[1])
+        return self.nearest_opponent("pokemon", x, y)
+
+    # Moves a client to (nx, ny) if the move is legal, and returns the client's location afterwards
+    #   Returns None if the client is not on the board (unregistered or already captured)
+    #   Locks only the regions of the client's old and new cells
+    def move_client(self, type, name, emojiID, nx, ny):
+
+        # Keep the move on the board
+        nx = min(max(nx, 0), self.board_size - 1)
+        ny = min(max(ny, 0), self.board_size - 1)
+
+        # Pick the dictionaries for the client's type
+        if type == "trainer":
+            clients, cells, grid, paths = self.trainers, self.trainer_cells, self.trainer_grid, self.trainer_paths
+        elif type == "pokemon":
+            clients, cells, grid, paths = self.pokemon, self.pokemon_cells, self.pokemon_grid, self.pokemon_paths
+        else:
+            return None
+
+        while True:
+            # Clients that are not on the board cannot move
+            old_loc = clients.get(name)
+            if old_loc is None:
+                return None
+            ox, oy = old_loc
+
+            with self.regions.hold((ox, oy), (nx, ny)):
+
+                # The client moved or was captured before the locks were taken - look again
+                if clients.get(name) != old_loc:
+                    continue
+
+                # Make sure there are no other clients of the same type in this spot
+                occupant = cells.get((nx, ny))
+                if occupant is not None and occupant != name:
+                    return (ox, oy)
+
+                # Adjust the client's location and add to the path directories
+                del cells[(ox, oy)]
+                cells[(nx, ny)] = name
+                clients[name] = (nx, ny)
+                grid.move(name, nx, ny)
+                paths[name].append((nx, ny))
+
+                # Update the game_board to reflect the changes
+                self.repaint(ox, oy)
+                self.repaint(nx, ny)
+
+                # Record the action while the cells are still locked, so the log holds moves in the order they happened
+                self.log_action("move", name, emojiID, (ox, oy), (nx, ny))
+
+            break
+
+        # Let subscribers of the opposite type know where this client went
+        self.publish_position(type, name, nx, ny)
+
+        return (nx, ny)
+
+    # Captures the pokemon standing on (x, y) for the trainer, and returns its name or None if the cell has no pokemon
+    #   Locks only the region of (x, y), so a pokemon can never be captured twice or move away part-way through
+    def capture_at(self, name, emojiID, x, y):
+
+        with self.regions.hold((x, y)):
+
+            # Look up the pokemon standing on this cell, if there is one
+            #   A trainer that was handed to another shard has no pokedex here, and captures nothing
+            pokemon = self.pokemon_cells.get((x, y))
+            pokedex = self.trainer_pokedexes.get(name)
+            if pokemon is None or pokedex is None:
+                return None
+
+            # Found a pokemon - add it to the pokedex and the owner map, and remove from pokemon dict
+            #   The owner is recorded before the pokemon leaves the board, so anyone who sees it gone can look up its owner
+            pokedex.append(pokemon)
+            self.owners[pokemon] = name
+            del self.pokemon[pokemon]
+            del self.pokemon_cells[(x, y)]
+            self.pokemon_grid.remove(pokemon)
+            self.repaint(x, y)
+
+            with self._game_lock:
+                self.capture_counter += 1
+                is_last = self.capture_counter == self.num_pkmn
+
+            # Record the action while the cell is still locked
+            self.log_action("capture", name, emojiID, (x, y), (x, y), pokemon)
+
+        if self.planner is not None:
+            self.planner.captured(pokemon)
+
+        # Tell the pokemon who caught it, and the trainers watching positions that it left the board
+        with self._stream_lock:
+            self.publish(pokemon, pokemonou_pb2.Event(kind="captured", name=name))
+            for events in self.position_subscribers["trainer"]:
+                events.put(pokemonou_pb2.Event(kind="removed", name=pokemon))
+
+            # Capturing the last pokemon ends the game
+            if is_last and self.update_status() == "over":
+                for queues in self.subscribers.values():
+                    for events in queues:
+                        events.put(pokemonou_pb2.Event(kind="over"))
+
+        return pokemon
+
+    # Records an action in the action log, and queues it to be shown on the next printout of the board
+    #   Callers changing the board should hold the region locks of the cells they changed, so the log can be replayed in order
+    def log_action(self, kind, name, icon, start=(-1, -1), end=(-1, -1), target=None):
+        tick = self.scheduler.tick if self.scheduler is not None else 0
+        self.current_actions.append(self.action_log.record(tick, kind, name, icon, start, end, target))
+        return
 
-        self.last_output_len = self.board_size + 4 * len(self.current_actions) + 3
+    # Pushes an event to every stream the client has open
+    #   Callers must hold self._stream_lock
+    def publish(self, name, event):
+        for events in self.subscribers.get(name, []):
+            events.put(event)
+        return
 
-        self.current_actions = []
+    # Pushes a client's new location to every subscriber of the opposite type that asked for positions
+    def publish_position(self, type, name, x, y):
+        watchers = self.position_subscribers["pokemon" if type == "trainer" else "trainer"]
+        if len(watchers) == 0:
+            return
 
+        with self._stream_lock:
+            for events in watchers:
+                events.put(pokemonou_pb2.Event(kind="position", name=name, loc=pokemonou_pb2.Location(x=x, y=y)))
         return
 
+    # Returns the name of the trainer whose pokedex holds the pokemon, or None if it is still free
+    def owner_of(self, name):
+        return self.owners.get(name)
 
 
     """
@@ -121,13 +1690,14 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
 
     # Checks if the game is over by checking if all the pokemon are captured
     def game_status(self, request, context):
-        # Can check if all pokemon are captured by checking if self.pokemon is empty
-        if len(self.pokemon) == 0 and self.capture_counter == self.num_pkmn:
-            self.status = "over"
-        else:
-            self.status = "active"
+        return pokemonou_pb2.GameStatus(status=self.update_status())
 
-        return pokemonou_pb2.GameStatus(status=self.status)
+
+    # Returns the call count and latency histogram of every RPC, and the current value of every game gauge
+    def stats(self, request, context):
+        rpcs = [pokemonou_pb2.RpcStats(name=name, calls=calls, total_seconds=total, bucket_counts=buckets)
+                for name, (calls, total, buckets) in sorted(self.metrics.snapshot().items())]
+        return pokemonou_pb2.Stats(rpcs=rpcs, bucket_bounds=Metrics.BUCKETS, gauges=self.gauges())
 
 
     # Registers a client with the server, and allocates them an emoji for their icon, and a location on the board
@@ -135,176 +1705,352 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
 
         _emoji = ":skull:"
 
-        with self._key_lock:
-            if request.type == "trainer":
-                # Add the trainer to the server if they are not already registered as a key in self.trainers dict
-                if request.name not in self.trainers:
-
-                    # Choose a random emoji from the people emoji list, and check if it has been used
-                    emoji_idx = random.randint(0, len(self.people_emojis) - 1)
-                    while self.used_people_emojis[emoji_idx] == True:
-                        emoji_idx = random.randint(0, len(self.people_emojis) - 1)
-
-                    # Found an emoji - update the used people emoji list and send to the client
-                    self.used_people_emojis[emoji_idx] = True
-                    _emoji = self.people_emojis[emoji_idx]
+        with self._game_lock:
+            # A client restored from a checkpoint picks up where it left off, once
+            if request.name in self.reconnecting:
+                self.reconnecting.discard(request.name)
+                clients = self.trainers if request.type == "trainer" else self.pokemon
+                x, y = clients.get(request.name, (-1, -1))
+                return pokemonou_pb2.ClientInfo(name=request.name, emojiID=self.icons[request.name], xLocation=x, yLocation=y,
+                                                id=self.agent_id(request.name, request.type))
 
-                    self.current_actions.append(request.name + " connected to the server as " + emoji.emojize(_emoji.strip()))
-                else:
-                    # If client has already connected, return skull emoji to denote that
-                    return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=-1, yLocation=-1)
+            # If client has already connected (or is connecting right now), return skull emoji to denote that
+            if request.name in self.icons:
+                return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=-1, yLocation=-1)
 
+            if request.type == "trainer":
+                emojis, used, free = self.people_emojis, self.used_people_emojis, self.free_people_emojis
             elif request.type == "pokemon":
-                # Add the pokemon to the server if they are not already registered as a key in self.pokemon dict
-                if request.name not in self.pokemon:
-
-                    # Choose a random emoji from animal emoji list, and check if it has been used
-                    emoji_idx = random.randint(0, len(self.animal_emojis) - 1)
-                    while self.used_animal_emojis[emoji_idx] == True:
-                        emoji_idx = random.randint(0, len(self.animal_emojis) - 1)
-                    
-                    # Found an emoji - update the used animal list
-                    self.used_animal_emojis[emoji_idx] = True
-                    _emoji = self.animal_emojis[emoji_idx]
-
-                    self.current_actions.append(request.name + " connected to the server as " + emoji.emojize(_emoji.strip()))
-                else:
-                    return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=-1, yLocation=-1)
-
-            # Assign the client a spot on the board as well
-            # Unoccupied spots are denoted by ":seedling:"
-            x = random.randint(0, self.board_size - 1)
-            y = random.randint(0, self.board_size - 1)
-
-            # If the spot is preoccupied, keep trying
-            while self.game_board[x][y] != ":seedling:":
-                x = random.randint(0, self.board_size - 1)
-                y = random.randint(0, self.board_size - 1)  
+                emojis, used, free = self.animal_emojis, self.used_animal_emojis, self.free_animal_emojis
+            else:
+                return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=-1, yLocation=-1)
+
+            # Every emoji for this type of client is taken
+            if len(free) == 0:
+                return self.refuse_client(request, context, f"every {request.type} emoji is already in use")
+
+            # Take the next emoji from the shuffled list of unused ones
+            emoji_idx = free.pop()
+            used[emoji_idx] = True
+            _emoji = emojis[emoji_idx]
+
+            # Reserve the name, so a second registration under it is turned away
+            self.icons[request.name] = _emoji
+            id = self.agent_id(request.name, request.type)
+
+        # Assign the client an empty spot on the board as well
+        spot = self.place_client(request.type, request.name)
+        if spot is None:
+            # Every spot on the board is taken - hand the emoji and the name back
+            with self._game_lock:
+                used[emoji_idx] = False
+                free.append(emoji_idx)
+                del self.icons[request.name]
+            return self.refuse_client(request, context, "every spot on the board is already taken")
+        x, y = spot
+
+        self.publish_position(request.type, request.name, x, y)
+        self.start(force=False)
+
+        return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=x, yLocation=y, id=id)
+
+    # Returns the agent id of a client, giving it the next one if it has none yet
+    #   Callers must hold _game_lock
+    def agent_id(self, name, type):
+        id = self.agent_ids.get(name)
+        if id is None:
+            id = len(self.agents)
+            self.agents.append((name, type))
+            self.agent_ids[name] = id
+        return id
+
+    # Registers many clients in one call, as initialize_client does for each, and returns their ClientInfos in the same order
+    #   A client that could not be registered gets the skull emoji and an off-board location, and the rest still go ahead
+    def initialize_clients(self, request, context):
+        return pokemonou_pb2.ClientInfoList(clients=[self.initialize_client(name, None) for name in request.names])
+
+
+    # Puts a client whose icon is already in self.icons on the board, and returns its (x, y) location
+    #   With no location given, the client goes on a random empty spot, trying each region once
+    #   With a location given, the client goes there unless another client of the same type holds it
+    #   Returns None if there was no room
+    def place_client(self, type, name, x=None, y=None, path=None, pokedex=None):
+        steps = len(path) if path is not None else 0
+
+        if x is not None:
+            with self.regions.hold((x, y)):
+                cells = self.trainer_cells if type == "trainer" else self.pokemon_cells
+                if (x, y) in cells:
+                    return None
+                self.add_client(type, name, x, y, path, pokedex)
+                self.log_placement(name, x, y, path, steps)
+            return (x, y)
+
+        for region in self.free_cells.regions_from_random():
+            with self.regions.hold_regions([region]):
+
+                # If every spot in this region is taken, try the next one
+                spot = self.free_cells.pick(region)
+                if spot is None:
+                    continue
+                self.add_client(type, name, spot[0], spot[1], path, pokedex)
+                self.log_placement(name, spot[0], spot[1], path, steps)
+            return spot
+
+        return None
+
+    # Records a client being placed on (x, y) - a connect for a new client, or a move if its path was steps long and grew
+    #   Callers must hold the region lock of (x, y)
+    def log_placement(self, name, x, y, path, steps):
+        if path is None:
+            self.log_action("connect", name, self.icons[name], end=(x, y))
+        elif len(path) > steps:
+            self.log_action("move", name, self.icons[name], path[-2], (x, y))
+        return
 
-            # Put the emoji in the spot
-            self.game_board[x][y] = _emoji
+    # Adds a client and its location to the server's dictionaries and paths, and puts its emoji on the board
+    #   path and pokedex carry over what the client did on another shard, if it has been handed off
+    #   Callers must hold the region lock of (x, y)
+    def add_client(self, type, name, x, y, path=None, pokedex=None):
+        if path is None:
+            path = PathHistory(x, y, self.board_size)
+        elif path[-1] != (x, y):
+            path.append((x, y))
 
-            # Add the client and their location to the server's dictionaries and paths
-            if request.type == "trainer":
-                self.trainers[request.name] = (x, y)
-                self.trainer_paths[request.name] = [(x, y)]
-                self.trainer_pokedexes[request.name] = []
-            elif request.type == "pokemon":
-                self.pokemon[request.name] = (x, y)
-                self.pokemon_paths[request.name] = [(x, y)]
+        if type == "trainer":
+            self.trainer_paths[name] = path
+            self.trainer_pokedexes[name] = pokedex if pokedex is not None else []
+            self.trainer_cells[(x, y)] = name
+            self.trainer_grid.insert(name, x, y)
+            self.trainers[name] = (x, y)
+        elif type == "pokemon":
+            self.pokemon_paths[name] = path
+            self.pokemon_cells[(x, y)] = name
+            self.pokemon_grid.insert(name, x, y)
+            self.pokemon[name] = (x, y)
 
-        return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=x, yLocation=y)
+        self.repaint(x, y)
+        return
 
+    # Turns a client away because the game has run out of room for it
+    #   The client gets the skull emoji and an off-board location, and the call fails with RESOURCE_EXHAUSTED
+    def refuse_client(self, request, context, reason):
+        msg = f"{request.name} could not connect: {reason}"
+        self.current_actions.append(msg)
+        if context is not None:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(msg)
+        return pokemonou_pb2.ClientInfo(name=request.name, emojiID=":skull:", xLocation=-1, yLocation=-1)
 
     # Returns the location of the nearest client of the opposite type to the client
+    #   Reads a consistent snapshot of the board without blocking clients that are moving
     def check_board(self, request, context):
 
-        with self._key_lock:
-            current_x = request.xLocation
-            current_y = request.yLocation
-
-            type = re.sub(r'[0-9]', '', request.name)
-            nx = -1
-            ny = -1
-            nearest_dist = self.board_size * 2
-
-            if type == "trainer":
+        current_x = request.xLocation
+        current_y = request.yLocation
 
-                # Check for the case where no pokemon are around
-                if len(self.pokemon) < 1:
-                    return pokemonou_pb2.Location(x=current_x, y=current_y)
-
-                for pokemon, p_loc in self.pokemon.items():
-                    dist = math.sqrt((current_x - p_loc[0])**2 + (current_y - p_loc[1])**2)
-                    if dist < nearest_dist:
-                        nearest_dist = dist
-                        nx = p_loc[0]
-                        ny = p_loc[1]
+        type = re.sub(r'[0-9]', '', request.name)
+        nx = -1
+        ny = -1
 
-            elif type == "pokemon":
+        # Search the spatial index of the opposite type for the nearest client
+        if type != "trainer" and type != "pokemon":
+            return pokemonou_pb2.Location(x=nx, y=ny)
 
-                # Check for the case where no trainers are around
-                if len(self.trainers) < 1:
-                    return pokemonou_pb2.Location(x=current_x, y=current_y)
+        # Check for the case where no clients of the other type are around
+        #   Trainers are pointed at the pokemon they were assigned, if a planner is on, and pokemon at what to run from
+        if type == "trainer":
+            nearest = self.chase_target(request.name, current_x, current_y)
+        else:
+            nearest = self.flee_from(request.name, current_x, current_y)
+        if nearest is None:
+            return pokemonou_pb2.Location(x=current_x, y=current_y)
 
-                for trainer, t_loc in self.trainers.items():
-                    dist = math.sqrt((current_x - t_loc[0])**2 + (current_y - t_loc[1])**2)
-                    if dist < nearest_dist:
-                        nearest_dist = dist
-                        nx = t_loc[0]
-                        ny = t_loc[1]
+        nx, ny = nearest
 
-            return pokemonou_pb2.Location(x=nx, y=ny)
+        return pokemonou_pb2.Location(x=nx, y=ny)
 
 
     # Checks that a move is legal, then moves the client to the specified spot
     def move(self, request, context):
         
-        with self._key_lock:
-
-            # Check that the move is valid
-            nx = request.newloc.x
-            ny = request.newloc.y
-
-            if nx < 0:
-                nx = 0
-            if nx > self.board_size - 1:
-                nx = self.board_size - 1
-
-            if ny < 0:
-                ny = 0
-            if ny > self.board_size - 1:
-                ny = self.board_size - 1
-
-            # Adjust the client's location and add to the path directories
-            if request.name.type == "trainer":
-                # Make sure there are no other trainers in this spot
-                if self.game_board[nx][ny] not in self.people_emojis:
-                    self.trainers[request.name.name] = (nx, ny)
-                    self.trainer_paths[request.name.name].append((nx, ny))
-                else:
-                    return pokemonou_pb2.Location(x=request.oldloc.x, y=request.oldloc.y)
-
-            elif request.name.type == "pokemon":
-                # Make sure there are no other pokemon in this spot
-                if self.game_board[nx][ny] not in self.animal_emojis:
-                    self.pokemon[request.name.name] = (nx, ny)
-                    self.pokemon_paths[request.name.name].append((nx, ny))
-                else:
-                    return pokemonou_pb2.Location(x=request.oldloc.x, y=request.oldloc.y)
-
-            # Update the game_board to reflect the changes
-            self.game_board[request.oldloc.x][request.oldloc.y] = ":seedling:"
-            self.game_board[nx][ny] = request.emojiID
+        new_loc = self.move_client(request.name.type, request.name.name, request.emojiID, request.newloc.x, request.newloc.y)
 
-            # Add the action message to the lists
-            action_msg = f"{request.name.name} ({emoji.emojize(request.emojiID.strip())}) moved to ({nx}, {ny}) from ({request.oldloc.x}, {request.oldloc.y})"
-            self.action_list.append(action_msg)
-            self.current_actions.append(action_msg)
+        # The client is not on the board - leave it where it claims to be
+        if new_loc is None:
+            return pokemonou_pb2.Location(x=request.oldloc.x, y=request.oldloc.y)
 
-            return pokemonou_pb2.Location(x=nx, y=ny)
+        return pokemonou_pb2.Location(x=new_loc[0], y=new_loc[1])
     
     # Will display the entire path that a client has taken throughout the game
     def show_path(self, request, context):
 
         type = re.sub(r'[0-9]', '', request.name)
+        paths = self.trainer_paths if type == "trainer" else self.pokemon_paths
+        path = paths.get(request.name) if type in ("trainer", "pokemon") else None
+
+        # Add the path to the current actions to be performed, a chunk of locations per message
+        if path is not None:
+            for start in range(0, len(path), self.PATH_CHUNK):
+                locations = " -> ".join(f"({x}, {y})" for x, y in path[start:start + self.PATH_CHUNK])
+                if start + self.PATH_CHUNK >= len(path):
+                    locations += " -> end"
+
+                if start == 0:
+                    self.current_actions.append(f"{request.name}'s path: " + locations)
+                else:
+                    self.current_actions.append(f"{request.name}'s path (from step {start}): " + locations)
+
+        return pokemonou_pb2.Name(name=request.name, type=type)
+
+    # Returns up to count locations of a client's path, starting at index start (negative counts back from the end)
+    #   A count of 0 or less returns everything from start onwards
+    def path_slice(self, request, context):
+
+        paths = self.trainer_paths if request.type == "trainer" else self.pokemon_paths
+        path = paths.get(request.name)
+        if path is None:
+            return pokemonou_pb2.LocationList()
+
+        start, stop, _ = slice(request.start, None).indices(len(path))
+        if request.count > 0:
+            stop = min(stop, start + request.count)
+
+        return pokemonou_pb2.LocationList(locs=[pokemonou_pb2.Location(x=x, y=y) for x, y in path[start:stop]])
+
+
+    # Plays a whole turn for a client in one call, in place of the capture, check_board, move and game_status chain
+    #   Trainers: capture on the current spot, otherwise move one spot towards the nearest pokemon and attempt a capture again
+    #   Pokemon: if not captured, move one spot directly away from the nearest trainer
+    #   If the server owns the clock, the turn waits to be played as part of the next tick
+    def step(self, request, context):
+        return self.step_client(request.name, request.type)
+
+    # Plays a whole turn for a client, waiting for the next tick if the server owns the clock
+    def step_client(self, name, type):
+
+        if self.scheduler is not None:
+            result = self.scheduler.request_turn(name, type)
+            if result is not None:
+                return result
+
+        return self.play_turn(name, type)
+
+    # Plays every turn requested for a tick in a fixed order - trainers, then pokemon, each in the order they registered
+    #   requests is a dict of client name -> (type, ...), and a dict of client name -> StepResult is returned
+    def play_tick(self, requests, tick):
+        if self.planner is not None:
+            self.planner.maybe_plan(tick)
+
+        order = [name for name in list(self.trainers) if name in requests] + [name for name in list(self.pokemon) if name in requests]
+
+        # Clients that are off the board (captured or unregistered) go last, in the order they asked
+        on_board = set(order)
+        order += [name for name in requests if name not in on_board]
+
+        results = {}
+        for name in order:
+            results[name] = self.play_turn(name, requests[name][0], tick)
+
+        return results
+
+    # Plays one turn for a client and returns its StepResult
+    #   Each capture and move locks only the board regions it touches, so turns in different parts of the board run in parallel
+    def play_turn(self, name, type, tick=0):
+        captured = ""
 
-        path_str = f"{request.name}'s path: "
         if type == "trainer":
-            
-            for location in self.trainer_paths[request.name]:
-                path_str += f"({location[0]}, {location[1]}) -> "
-            path_str += "end"
+            loc = self.trainers.get(name)
+            icon = self.icons.get(name)
+            if loc is not None and icon is not None:
+
+                pokemon = self.capture_at(name, icon, loc[0], loc[1])
+                if pokemon is None:
+                    # No Pokemon was caught - move towards the pokemon to chase and attempt a capture again
+                    nearest = self.chase_target(name, loc[0], loc[1])
+                    if nearest is not None:
+                        dx = (nearest[0] > loc[0]) - (nearest[0] < loc[0])
+                        dy = (nearest[1] > loc[1]) - (nearest[1] < loc[1])
+                        loc = self.move_client("trainer", name, icon, loc[0] + dx, loc[1] + dy)
+
+                    if loc is not None:
+                        pokemon = self.capture_at(name, icon, loc[0], loc[1])
+
+                if pokemon is not None:
+                    captured = pokemon
+
+            if loc is None or icon is None:
+                # The trainer is off the board, or was handed to another shard part-way through its turn
+                return pokemonou_pb2.StepResult(status=self.update_status(), loc=pokemonou_pb2.Location(x=-1, y=-1), captured=captured, tick=tick)
+
+            x, y = loc
 
         elif type == "pokemon":
-            for location in self.pokemon_paths[request.name]:
-                path_str += f"({location[0]}, {location[1]}) -> "
-            path_str += "end"
+            loc = self.pokemon.get(name)
+            icon = self.icons.get(name)
+            if loc is not None and icon is not None:
+
+                # Check where to run from and move 1 spot in the opposite direction
+                #   A flee field is built once per tick, after every trainer has moved
+                nearest = self.flee_from(name, loc[0], loc[1], tick if self.scheduler is not None else None)
+                if nearest is not None:
+                    dx = (nearest[0] < loc[0]) - (nearest[0] > loc[0])
+                    dy = (nearest[1] < loc[1]) - (nearest[1] > loc[1])
+                    loc = self.move_client("pokemon", name, icon, loc[0] + dx, loc[1] + dy)
+
+            if loc is None or icon is None:
+                # The pokemon is off the board, or was captured or handed to another shard part-way through its turn
+                #   Let it know who captured it, if anyone did
+                trainer = self.owner_of(name)
+                if trainer is not None:
+                    captured = trainer
+                return pokemonou_pb2.StepResult(status=self.update_status(), loc=pokemonou_pb2.Location(x=-1, y=-1), captured=captured, tick=tick)
+
+            x, y = loc
+
+        else:
+            return pokemonou_pb2.StepResult(status=self.update_status(), loc=pokemonou_pb2.Location(x=-1, y=-1), captured=captured, tick=tick)
+
+        return pokemonou_pb2.StepResult(status=self.update_status(), loc=pokemonou_pb2.Location(x=x, y=y), captured=captured, tick=tick)
+
+
+    # Registers the event queue of a client's stream, and catches it up on anything that already happened
+    #   events can be any object with a put(event) method that does not block
+    def open_stream(self, request, events):
+        with self._stream_lock:
+            self.subscribers.setdefault(request.name, []).append(events)
+
+            # Start with a snapshot of every opponent's location, followed by a "synced" event
+            # Moves made while the snapshot is taken are also streamed as positions, so none are missed
+            if request.positions and request.type in self.position_subscribers:
+                opponents = self.pokemon if request.type == "trainer" else self.trainers
+                for name, loc in list(opponents.items()):
+                    events.put(pokemonou_pb2.Event(kind="position", name=name, loc=pokemonou_pb2.Location(x=loc[0], y=loc[1])))
+                events.put(pokemonou_pb2.Event(kind="synced"))
+                self.position_subscribers[request.type].append(events)
+
+            # Catch the client up on anything that already happened before it subscribed
+            if request.type == "pokemon":
+                trainer = self.owner_of(request.name)
+                if trainer is not None:
+                    events.put(pokemonou_pb2.Event(kind="captured", name=trainer))
+            if self.update_status() == "over":
+                events.put(pokemonou_pb2.Event(kind="over"))
+        return
 
-        # Add the path string to the current actions to be performed
-        self.current_actions.append(path_str)
+    # Unregisters the event queue of a client's stream
+    def close_stream(self, request, events):
+        with self._stream_lock:
+            self.subscribers[request.name].remove(events)
+            if len(self.subscribers[request.name]) == 0:
+                del self.subscribers[request.name]
+            if events in self.position_subscribers.get(request.type, []):
+                self.position_subscribers[request.type].remove(events)
+        return
 
-        return pokemonou_pb2.Name(name=request.name, type=type)
+    # Returns True if the event is the last one a client's stream will send
+    def is_final_event(self, request, event):
+        return event.kind == "over" or (event.kind == "captured" and request.type == "pokemon")
 
 
     """
@@ -313,35 +2059,26 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
     
     # If a pokemon is in the space the trainer is in, then the trainer has captured it and it will be removed from the board
     def capture(self, request, context):
-        with self._key_lock:
-            x = request.xLocation
-            y = request.yLocation
+        x = request.xLocation
+        y = request.yLocation
 
-            for pokemon, loc in self.pokemon.items():
-                if x == loc[0] and y == loc[1]:
-                    # Found a pokemon - add it to the pokedex, and remove from pokemon dict
-                    self.trainer_pokedexes[request.name].append(pokemon)
-                    del self.pokemon[pokemon]
-                    self.capture_counter += 1
+        pokemon = self.capture_at(request.name, request.emojiID, x, y)
+        if pokemon is not None:
+            # Return the name of the pokemon
+            return pokemonou_pb2.Name(name=pokemon, type="pokemon")
 
-                    # Add to the output list
-                    self.current_actions.append(f"{request.name} ({emoji.emojize(request.emojiID.strip())}) has captured {pokemon}")
-
-                    # Return the name of the pokemon
-                    return pokemonou_pb2.Name(name=pokemon, type="pokemon")
-
-            return pokemonou_pb2.Name(name="failure", type="pokemon")
+        return pokemonou_pb2.Name(name="failure", type="pokemon")
 
     # Displays the entire pokedex of a trainer with all the pokemon they have caught
     def show_pokedex(self, request, context):
 
         # Check if the Trainer's dex is empty, if not append each pokemon to a list to be output
+        pokedex = self.trainer_pokedexes.get(request.name, [])
         pkdx_str = f"{request.name}'s Pokedex: "
-        if len(self.trainer_pokedexes[request.name]) == 0:
+        if len(pokedex) == 0:
             pkdx_str += "Empty"
         else:
-            for pkmn in self.trainer_pokedexes[request.name]:
-                pkdx_str += f"{pkmn} - "
+            pkdx_str += "".join(f"{pkmn} - " for pkmn in pokedex)
 
         self.current_actions.append(pkdx_str)
 
@@ -354,10 +2091,10 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
 
     # If a pokemon is captured, this will let them know
     def captured(self, request, context):
-        # Check if this pokemon exists in any of the trainers pokedexes
-        for trainer, pokedex in self.trainer_pokedexes.items():
-            if request.name in pokedex:
-                return pokemonou_pb2.Name(name=trainer, type="trainer")
+        # Look up the trainer that caught this pokemon, if any
+        trainer = self.owner_of(request.name)
+        if trainer is not None:
+            return pokemonou_pb2.Name(name=trainer, type="trainer")
 
         # Return the name as "free" if it is not captured
         return pokemonou_pb2.Name(name="free", type="")
@@ -366,11 +2103,483 @@ class PokemonOUGame(pokemonou_pb2_grpc.PokemonOUServicer):
     # Displays the trainer's name and emoji of the pokemon
     def show_trainer_info(self, request, context):
 
-        for trainer, _ in self.trainers.items():
-            pokedex = self.trainer_pokedexes[trainer]
-            if request.name in pokedex:
-                self.current_actions.append(f"{trainer} owns {request.name}")
-                return pokemonou_pb2.Name(name=trainer, type="trainer")
+        trainer = self.owner_of(request.name)
+        if trainer is not None:
+            self.current_actions.append(f"{trainer} owns {request.name}")
+            return pokemonou_pb2.Name(name=trainer, type="trainer")
+
+        return pokemonou_pb2.Name(name="free", type="")
+
+
+    """
+    Agent Id Functions
+        - The slim versions of step, move, capture and check_board, for clients that were given an agent id
+        - The client is looked up by its id, and its name, type, emoji and location are the ones the server keeps
+    """
+
+    # Returns the (name, type) of the client that was given an agent id, or (None, None) if no client was given it
+    def agent(self, id):
+        if 0 < id < len(self.agents):
+            return self.agents[id]
+        return (None, None)
+
+    # Plays a whole turn for a client, as step does
+    def agent_step(self, request, context):
+        name, type = self.agent(request.id)
+        if name is None:
+            return pokemonou_pb2.StepResult(status=self.update_status(), loc=pokemonou_pb2.Location(x=-1, y=-1))
+
+        return self.step_client(name, type)
+
+    # Moves a client one spot in the direction it asked for, from where the server has it
+    #   Returns the client's location afterwards, or (-1, -1) if it is not on the board
+    def agent_move(self, request, context):
+        name, type = self.agent(request.id)
+        clients = self.trainers if type == "trainer" else self.pokemon
+        loc = clients.get(name)
+        icon = self.icons.get(name)
+        if loc is None or icon is None:
+            return pokemonou_pb2.Location(x=-1, y=-1)
+
+        dx = min(max(request.dx, -1), 1)
+        dy = min(max(request.dy, -1), 1)
+        new_loc = self.move_client(type, name, icon, loc[0] + dx, loc[1] + dy)
+        if new_loc is None:
+            return pokemonou_pb2.Location(x=-1, y=-1)
+
+        return pokemonou_pb2.Location(x=new_loc[0], y=new_loc[1])
+
+    # Captures the pokemon on the trainer's spot, as capture does
+    def agent_capture(self, request, context):
+        name, type = self.agent(request.id)
+        loc = self.trainers.get(name) if type == "trainer" else None
+        icon = self.icons.get(name)
+
+        if loc is not None and icon is not None:
+            pokemon = self.capture_at(name, icon, loc[0], loc[1])
+            if pokemon is not None:
+                return pokemonou_pb2.Name(name=pokemon, type="pokemon")
+
+        return pokemonou_pb2.Name(name="failure", type="pokemon")
+
+    # Returns the location the client should head towards, or run away from if it is a pokemon, as check_board does
+    def agent_check_board(self, request, context):
+        name, type = self.agent(request.id)
+        clients = self.trainers if type == "trainer" else self.pokemon
+        loc = clients.get(name)
+        if loc is None:
+            return pokemonou_pb2.Location(x=-1, y=-1)
+
+        if type == "trainer":
+            target = self.chase_target(name, loc[0], loc[1])
+        else:
+            target = self.flee_from(name, loc[0], loc[1])
+        if target is None:
+            return pokemonou_pb2.Location(x=loc[0], y=loc[1])
+
+        return pokemonou_pb2.Location(x=target[0], y=target[1])
+
+
+    """
+    Shard Functions
+        - Called by the shard router (shard.py) when this game is one tile of a board split across several servers
+    """
+
+    # Puts a client on this shard, carrying over its emoji, path and pokedex from the shard it came from
+    #   The client goes on request.loc, or on any empty spot of the tile if request.anywhere is set
+    #   Returns the client's state with its new location, or an empty name if there was no room
+    def admit(self, request, context):
+        refused = pokemonou_pb2.ClientState()
+
+        with self._game_lock:
+            if request.name in self.icons:
+                return refused
+            self.icons[request.name] = request.emojiID
+
+        path = None
+        if len(request.path) > 0:
+            path = PathHistory(0, 0, self.board_size)
+            path.frombytes(request.path)
+
+        if request.anywhere:
+            spot = self.place_client(request.type, request.name, path=path, pokedex=list(request.pokedex))
+        else:
+            spot = self.place_client(request.type, request.name, request.loc.x, request.loc.y, path, list(request.pokedex))
+
+        if spot is None:
+            with self._game_lock:
+                del self.icons[request.name]
+            return refused
+        x, y = spot
+
+        self.publish_position(request.type, request.name, x, y)
+
+        return pokemonou_pb2.ClientState(name=request.name, type=request.type, emojiID=request.emojiID,
+                                         loc=pokemonou_pb2.Location(x=x, y=y), path=request.path, pokedex=request.pokedex)
+
+    # Takes a client off this shard so it can be handed to another one, and returns everything the next shard needs
+    #   Returns an empty name if the client is not on this shard (never admitted, or already captured)
+    def release(self, request, context):
+
+        if request.type == "trainer":
+            clients, cells, grid, paths = self.trainers, self.trainer_cells, self.trainer_grid, self.trainer_paths
+        elif request.type == "pokemon":
+            clients, cells, grid, paths = self.pokemon, self.pokemon_cells, self.pokemon_grid, self.pokemon_paths
+        else:
+            return pokemonou_pb2.ClientState()
+
+        while True:
+            loc = clients.get(request.name)
+            if loc is None:
+                return pokemonou_pb2.ClientState()
+
+            with self.regions.hold(loc):
+
+                # The client moved or was captured before the lock was taken - look again
+                if clients.get(request.name) != loc:
+                    continue
+
+                del clients[request.name]
+                del cells[loc]
+                grid.remove(request.name)
+                path = paths.pop(request.name)
+                pokedex = self.trainer_pokedexes.pop(request.name, [])
+                self.repaint(loc[0], loc[1])
+
+            break
+
+        with self._game_lock:
+            emojiID = self.icons.pop(request.name)
+
+        # Opponents watching positions on this shard lose sight of the client
+        with self._stream_lock:
+            for events in self.position_subscribers["pokemon" if request.type == "trainer" else "trainer"]:
+                events.put(pokemonou_pb2.Event(kind="removed", name=request.name))
+
+        return pokemonou_pb2.ClientState(name=request.name, type=request.type, emojiID=emojiID,
+                                         loc=pokemonou_pb2.Location(x=loc[0], y=loc[1]), path=path.tobytes(), pokedex=pokedex)
+
+    # Returns the location of the nearest client of the opposite type on this shard, or (-1, -1) if there are none
+    #   Unlike check_board, an empty shard is never mistaken for an opponent standing on the client's own spot
+    def nearest(self, request, context):
+        type = re.sub(r'[0-9]', '', request.name)
+        nearest = self.nearest_opponent(type, request.xLocation, request.yLocation)
+        if nearest is None:
+            return pokemonou_pb2.Location(x=-1, y=-1)
+        return pokemonou_pb2.Location(x=nearest[0], y=nearest[1])
+
+
+
+"""
+The Async Event Queue class
+
+Lets the game push events from its worker threads into a stream that is being served on the asyncio event loop
+"""
+class AsyncEventQueue():
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        return
+
+    # Called by the game from any thread - never blocks
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        return
+
+    async def get(self):
+        return await self.queue.get()
+
+
+
+"""
+The Async PokemonOU Servicer class
+
+Serves every game in a GameRegistry from a grpc.aio server, sending each call to the game named in its request
+Blocking game calls run on a bounded pool of worker threads shared by every game, so the server's thread count stays
+the same no matter how many games are hosted, how large their boards are, or how many clients are connected
+Turns waiting on a tick scheduler and open event streams wait on the event loop instead of holding a worker
+"""
+class AsyncPokemonOUServicer():
+
+    GATED = {"check_board", "move", "capture", "agent_check_board", "agent_move", "agent_capture"}
+                                        # RPCs that wait at a game's start barrier, along with step and agent_step
+
+    def __init__(self, registry, max_workers=8):
+        self.registry = registry
+        self.pool = futures.ThreadPoolExecutor(max_workers=max_workers)
+        return
+
+    # Returns the game a request is for, or ends the call with NOT_FOUND if there is no such game
+    async def game_for(self, request, context):
+        game_id = request.name.game if isinstance(request, pokemonou_pb2.MoveInfo) else request.game
+        game = self.registry.get(game_id)
+        if game is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"there is no game with id '{game_id}'")
+        return game
+
+    # Any RPC without an asyncio version below runs the game's own method on the worker pool
+    def __getattr__(self, name):
+        if not hasattr(PokemonOUGame, name):
+            raise AttributeError(name)
+
+        async def call(request, context):
+            game = await self.game_for(request, context)
+            if name in self.GATED:
+                await self.wait_for_start(game)
+            start = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.pool, getattr(game, name), request, context)
+            finally:
+                game.metrics.observe(name, time.perf_counter() - start)
+
+        return call
+
+    # Waits on the event loop until a game has started, without holding a worker
+    async def wait_for_start(self, game):
+        if game.started.is_set():
+            return
+
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+        game.when_started(lambda: loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None)))
+        await started
+        return
+
+    async def step(self, request, context):
+        game = await self.game_for(request, context)
+        await self.wait_for_start(game)
+        start = time.perf_counter()
+        try:
+            return await self.play_step(game, request.name, request.type)
+        finally:
+            game.metrics.observe("step", time.perf_counter() - start)
+
+    async def agent_step(self, request, context):
+        game = await self.game_for(request, context)
+        await self.wait_for_start(game)
+        start = time.perf_counter()
+        try:
+            name, type = game.agent(request.id)
+            if name is None:
+                return pokemonou_pb2.StepResult(status=game.status, loc=pokemonou_pb2.Location(x=-1, y=-1))
+            return await self.play_step(game, name, type)
+        finally:
+            game.metrics.observe("agent_step", time.perf_counter() - start)
+
+    async def play_step(self, game, name, type):
+        loop = asyncio.get_running_loop()
+
+        # Wait for the scheduler to play this turn as part of the next tick, if the server owns the clock
+        if game.scheduler is not None:
+            turn = loop.create_future()
+            # The call may have been cancelled or timed out by the time the tick is played
+            game.scheduler.submit(name, type, lambda result: loop.call_soon_threadsafe(lambda: turn.done() or turn.set_result(result)))
+            result = await turn
+            if result is not None:
+                return result
+
+        return await loop.run_in_executor(self.pool, game.play_turn, name, type)
+
+    # Streams events to a client as they happen, so it does not have to poll captured and game_status
+    #   "captured" - this pokemon was caught by the trainer in the event's name, and the stream ends
+    #   "over" - every pokemon has been captured, and the stream ends
+    #   "position" / "removed" - an opponent moved to the event's location, or left the board (only if positions was asked for)
+    #   "synced" - every opponent's location has been sent once (only if positions was asked for)
+    #   Streams are counted when they open - how long they stay open says nothing about how busy the server is
+    async def subscribe(self, request, context):
+        game = await self.game_for(request, context)
+        game.metrics.observe("subscribe", 0.0)
+        loop = asyncio.get_running_loop()
+
+        events = AsyncEventQueue(loop)
+        await loop.run_in_executor(self.pool, game.open_stream, request, events)
+
+        # The stream is cancelled if the client goes away
+        try:
+            while True:
+                event = await events.get()
+                yield event
+
+                if game.is_final_event(request, event):
+                    break
+        finally:
+            game.close_stream(request, events)
+
+        return
+
+    # Creates a new game with its own board, clients and clock
+    #   Configs that are out of range are refused with INVALID_ARGUMENT, and games past the registry's limit with RESOURCE_EXHAUSTED
+    async def create_game(self, request, context):
+        tick_interval = request.tick_interval if request.server_clock else None
+        plan_every = request.plan_every if request.plan_every != 0 else None
+        flee = request.flee or "nearest"
+        num_trainers = request.num_trainers if request.num_trainers != 0 else None
+
+        problem = self.registry.check_config(request.board_size, request.total_pkmn, tick_interval, plan_every, flee, num_trainers)
+        if problem is not None:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, problem)
+        if request.game != "" and request.game in self.registry.games:
+            await context.abort(grpc.StatusCode.ALREADY_EXISTS, f"there is already a game with id '{request.game}'")
+        if self.registry.full():
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"the server already hosts {self.registry.max_games} games")
+
+        created = await asyncio.get_running_loop().run_in_executor(self.pool, functools.partial(
+            self.registry.create, request.game or None, request.board_size, request.total_pkmn, tick_interval, plan_every=plan_every,
+            flee=flee, num_trainers=num_trainers))
+        if created is None:
+            if request.game != "" and request.game in self.registry.games:
+                await context.abort(grpc.StatusCode.ALREADY_EXISTS, f"there is already a game with id '{request.game}'")
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"the server already hosts {self.registry.max_games} games")
+
+        return pokemonou_pb2.GameInfo(game=created[0], status="active")
+
+    # Ends a game right away - it is removed from the server once reaped
+    async def end_game(self, request, context):
+        if request.game not in self.registry.reapable and self.registry.get(request.game) is not None:
+            await context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"game '{request.game}' runs for as long as the server does")
+
+        game = await asyncio.get_running_loop().run_in_executor(self.pool, self.registry.end, request.game)
+        return pokemonou_pb2.GameInfo(game=request.game, status="over" if game is not None else "missing")
+
+
+
+"""
+The Game Registry class
+
+Holds every game a server is hosting, by game id, so one server process can run many independent games at once
+Each game keeps its own state and its own locks, so games never wait on each other
+Games are created on demand, and games that have been over for reap_after seconds are removed by reap
+Games nobody has called for idle_after seconds are taken to be abandoned, and are removed by reap too
+At most max_games games can be created on demand, each at most max_board_size spots across, so no client can exhaust the server
+"""
+class GameRegistry():
+
+    def __init__(self, reap_after=60, idle_after=600, max_games=64, max_board_size=1000):
+
+        self.reap_after = reap_after
+        self.idle_after = idle_after
+        self.max_games = max_games
+        self.max_board_size = max_board_size
+
+        self.games = {}                     # Dict: key = game id (string), value = the game (PokemonOUGame)
+        self.reapable = set()               # Set of the ids of games that reap may remove
+        self.over_since = {}                # Dict: key = game id (string), value = time the game was first seen over (float)
+        self.next_id = itertools.count(1)
+
+        self._lock = threading.Lock()       # Guards adding and removing games - looking one up takes no lock
+
+        return
+
+    # Returns the game with this id, or None if there is none
+    def get(self, game_id):
+        return self.games.get(game_id)
+
+    # Returns why a game asked for by a client cannot be created, or None if it can
+    def check_config(self, board_size, total_pkmn, tick_interval=None, plan_every=None, flee="nearest", num_trainers=None):
+        if not 1 <= board_size <= self.max_board_size:
+            return f"board_size must be between 1 and {self.max_board_size}"
+        if not 1 <= total_pkmn <= board_size * board_size:
+            return "total_pkmn must be between 1 and the number of spots on the board"
+        if tick_interval is not None and tick_interval < 0:
+            return "tick_interval cannot be negative"
+        if plan_every is not None and plan_every < 0:
+            return "plan_every cannot be negative"
+        if flee not in PokemonOUGame.FLEE_STRATEGIES:
+            return f"flee must be one of {', '.join(PokemonOUGame.FLEE_STRATEGIES)}"
+        if num_trainers is not None and num_trainers < 0:
+            return "num_trainers cannot be negative"
+        return None
+
+    # Returns True if no more games can be created on demand
+    def full(self):
+        return len(self.reapable) >= self.max_games
+
+    # Creates a game and starts its clock, and returns its id and the game
+    #   Returns None if the id is already taken, or if the game is reapable and there are already max_games of those
+    #   A game_id of None picks a new one
+    #   restore, if given, is a snapshot from PokemonOUGame.checkpoint to resume the game from, and log_path its log file
+    def create(self, game_id, board_size, total_pkmn, tick_interval=None, reapable=True, tile=None, restore=None, plan_every=None,
+               flee="nearest", num_trainers=None, log_path=None):
+        game = PokemonOUGame(board_size=board_size, total_pkmn=total_pkmn, tick_interval=tick_interval, tile=tile,
+                             seed=restore["seed"] if restore is not None else None, plan_every=plan_every, flee=flee,
+                             num_trainers=num_trainers, log_path=log_path)
+        if restore is not None:
+            game.restore(restore)
+
+        with self._lock:
+            if game_id is None:
+                game_id = f"game{next(self.next_id)}"
+                while game_id in self.games:
+                    game_id = f"game{next(self.next_id)}"
+            elif game_id in self.games:
+                return None
+            if reapable and self.full():
+                return None
+
+            self.games[game_id] = game
+            if reapable:
+                self.reapable.add(game_id)
+
+        if game.scheduler is not None:
+            game.scheduler.start()
+
+        return game_id, game
+
+    # Ends a game right away, and returns it, or None if there is no reapable game with this id
+    #   The game stays around until it is reaped, so its clients can still wrap up
+    #   Games that are not reapable, such as a server's default game, run for as long as the server does and cannot be ended
+    def end(self, game_id):
+        if game_id not in self.reapable:
+            return None
+
+        game = self.games.get(game_id)
+        if game is not None:
+            game.end()
+        return game
+
+    # Removes a game, ending it first if it is still going, and closes it
+    def remove(self, game_id):
+        with self._lock:
+            game = self.games.pop(game_id, None)
+            self.reapable.discard(game_id)
+            self.over_since.pop(game_id, None)
+
+        if game is not None:
+            game.close()
+        return game
+
+    # Removes every reapable game that has been over for at least reap_after seconds, or that nobody has called for
+    #   idle_after seconds, and returns their ids
+    def reap(self):
+        now = time.monotonic()
+        reaped = []
+
+        for game_id in list(self.reapable):
+            game = self.games.get(game_id)
+            if game is None:
+                continue
+
+            if game.metrics.idle() >= self.idle_after:
+                self.remove(game_id)
+                reaped.append(game_id)
+                continue
+
+            if game.status != "over":
+                continue
+
+            since = self.over_since.setdefault(game_id, now)
+            if now - since >= self.reap_after:
+                self.remove(game_id)
+                reaped.append(game_id)
+
+        return reaped
+
+    # Ends and removes every game
+    def close(self):
+        for game_id in list(self.games):
+            self.remove(game_id)
+        return
 
 
 
@@ -380,116 +2589,364 @@ The Server Class
 Handles input from both Trainers and Pokemon clients, and manages the grid
 """
 class Server():
-    
-    def serve(self, boardsize, totalpkmn):
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=boardsize**2))
-        game = PokemonOUGame(board_size=boardsize, total_pkmn=totalpkmn)
-        pokemonou_pb2_grpc.add_PokemonOUServicer_to_server(game, server)
-        server.add_insecure_port('[::]:50051')
-        server.start()
-        
+
+    # tick_interval is the length of a server-owned tick in seconds (0 for lockstep), or None to let clients set their own pace
+    # max_workers is the number of threads used for blocking game work, however many clients connect
+    # metrics_file, if given, is rewritten with the server's metrics in the Prometheus text format every metrics_interval seconds
+    # checkpoint_file, if given, is rewritten with a snapshot of the game every checkpoint_interval seconds
+    #   If it already exists when the server starts, the game is resumed from it instead of starting over
+    # plan_every, if given, has the server assign every trainer its own pokemon to chase, redone every plan_every ticks
+    # flee is "nearest" to have pokemon run straight away from their nearest trainer, or "field" to steer them with a FleeField
+    # num_trainers, if given, holds the game until that many trainers and every pokemon have connected
+    def serve(self, boardsize, totalpkmn, tick_interval=None, max_workers=8, metrics_file=None, metrics_interval=5,
+              checkpoint_file=None, checkpoint_interval=30, plan_every=None, flee="nearest", num_trainers=None):
+        try:
+            asyncio.run(self.serve_async(boardsize, totalpkmn, tick_interval, max_workers, metrics_file, metrics_interval,
+                                         checkpoint_file, checkpoint_interval, plan_every, flee, num_trainers))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    async def serve_async(self, boardsize, totalpkmn, tick_interval=None, max_workers=8, metrics_file=None, metrics_interval=5,
+                          checkpoint_file=None, checkpoint_interval=30, plan_every=None, flee="nearest", num_trainers=None):
+        await self.start_async(boardsize, totalpkmn, tick_interval, max_workers, checkpoint=checkpoint_file, plan_every=plan_every,
+                               flee=flee, num_trainers=num_trainers)
+        game = self.game
+
+        if metrics_file is not None:
+            asyncio.get_running_loop().create_task(self.dump_metrics(metrics_file, metrics_interval))
+        if checkpoint_file is not None:
+            asyncio.get_running_loop().create_task(self.save_checkpoints(checkpoint_file, checkpoint_interval))
+
         print('Server started')
 
+        over_count = 0
         try:
             while True:
                 # Check if game is over
-                over_count = 0
                 if game.status == "over":
-                    lock = threading.Lock()
-                    with lock:
-                        # Print only 1 time 
-                        if over_count == 0:
-                            time.sleep(3)
-
-                            # Print a list of all the actions once all Pokemon are captured
-                            print("ACTIONS: ")
-                            game.actions()
-                            over_count += 1
+                    # Print only 1 time 
+                    if over_count == 0:
+                        await asyncio.sleep(3)
+
+                        # Print a list of all the actions once all Pokemon are captured
+                        #   Written from a worker thread, so a long list does not stall the event loop
+                        print("ACTIONS: ")
+                        await asyncio.get_running_loop().run_in_executor(self.servicer.pool, game.actions)
+                        over_count += 1
+
+                    # Keep serving the clients wrapping up, without printing anything more
+                    await asyncio.sleep(1)
                 else:
                     # Print the board every second, with the list of actions that have occurred
                     game.print_board()
 
-                    time.sleep(1)
+                    await asyncio.sleep(1)
 
-        except KeyboardInterrupt:
-            server.stop(0)
+        finally:
+            await self.stop_async()
+
+        return
+
+    # Creates the default game and starts serving it on address, without printing anything
+    #   More games can be created by clients through create_game
+    #   The port the server ended up on is kept in self.port, so an address ending in :0 picks any free port
+    #   tile, if given, makes the default game one shard of a larger board (see shard.py)
+    #   checkpoint, if given and the file exists, is a checkpoint the default game is resumed from, board size and all
+    async def start_async(self, boardsize, totalpkmn, tick_interval=None, max_workers=8, address='[::]:50051', tile=None, checkpoint=None,
+                          plan_every=None, flee="nearest", num_trainers=None):
+        state = None
+        if checkpoint is not None and os.path.exists(checkpoint):
+            state = PokemonOUGame.read_checkpoint(checkpoint)
+            boardsize, totalpkmn = state["board_size"], state["num_pkmn"]
+
+        # The default game's older actions go straight to the log file kept next to its checkpoint
+        log_path = PokemonOUGame.checkpoint_log(checkpoint) if checkpoint is not None else None
+
+        self.registry = GameRegistry()
+        _, self.game = self.registry.create("", boardsize, totalpkmn, tick_interval, reapable=False, tile=tile, restore=state,
+                                            plan_every=plan_every, flee=flee, num_trainers=num_trainers, log_path=log_path)
+
+        self.server = grpc.aio.server()
+        self.servicer = AsyncPokemonOUServicer(self.registry, max_workers=max_workers)
+        pokemonou_pb2_grpc.add_PokemonOUServicer_to_server(self.servicer, self.server)
+        self.port = self.server.add_insecure_port(address)
+        await self.server.start()
+
+        self.reaper = asyncio.get_running_loop().create_task(self.reap_games())
+
+        return
+
+    # Removes games that have been over for a while, every 10 seconds
+    async def reap_games(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(10)
+            await loop.run_in_executor(self.servicer.pool, self.registry.reap)
+
+    # Writes the default game's metrics to a file every interval seconds, from a worker thread
+    async def dump_metrics(self, path, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(self.servicer.pool, self.game.dump_metrics, path)
+            await asyncio.sleep(interval)
+
+    # Writes a checkpoint of the default game every interval seconds, from a worker thread
+    #   Once the game is over, one last checkpoint is written and the loop stops
+    async def save_checkpoints(self, path, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            over = self.game.status == "over"
+            await loop.run_in_executor(self.servicer.pool, self.game.checkpoint, path)
+            if over:
+                break
+
+    # Stops every game and the server
+    async def stop_async(self):
+        self.reaper.cancel()
+        self.registry.close()
+        await self.server.stop(0)
+        self.servicer.pool.shutdown(wait=False)
+        return
+
+
+
+"""
+The World Cache class
+
+A client's own copy of where every opponent is, kept up to date from the position events of its subscribe stream
+Lets a client find its nearest opponent without asking the server, so the spatial work is spread over every client
+It is only ever a hint - moves and captures are still checked by the server
+"""
+class WorldCache():
+
+    def __init__(self, board_size):
+        self.grid = SpatialGrid(board_size)
+        self.gone = set()                   # Set of the names of opponents that left the board, whose late positions are ignored
+        self.synced = threading.Event()     # Set once the stream has sent every opponent's location once
+        self._lock = threading.Lock()
+        return
+
+    # Applies one event from the subscribe stream
+    def apply(self, event):
+        with self._lock:
+            if event.kind == "position" and event.name not in self.gone:
+                if event.name in self.grid.locations:
+                    self.grid.move(event.name, event.loc.x, event.loc.y)
+                else:
+                    self.grid.insert(event.name, event.loc.x, event.loc.y)
+            elif event.kind == "removed":
+                self.gone.add(event.name)
+                if event.name in self.grid.locations:
+                    self.grid.remove(event.name)
+        if event.kind == "synced":
+            self.synced.set()
+        return
 
+    # Returns the location of the nearest opponent, or None if there are none
+    def nearest(self, x, y):
+        with self._lock:
+            return self.grid.nearest(x, y)
+
+    # Forgets every opponent, ready for a new stream to send their locations again
+    def clear(self):
+        with self._lock:
+            self.grid = SpatialGrid(self.grid.board_size)
+            self.gone = set()
+            self.synced.clear()
         return
 
 
 
+# Returns the channel a client plays over, to use in a with statement
+#   A shared channel is handed back as is and left open for the other clients on it, otherwise the client opens its own
+#   While the server is not up yet, the channel tries again after 0.2 seconds, backing off to every 5 seconds at most,
+#   instead of gRPC's default of up to two minutes
+def client_channel(address, interceptors=(), channel=None):
+    if channel is not None:
+        return contextlib.nullcontext(channel)
+
+    options = [("grpc.initial_reconnect_backoff_ms", 200), ("grpc.min_reconnect_backoff_ms", 200), ("grpc.max_reconnect_backoff_ms", 5000)]
+    return grpc.intercept_channel(grpc.insecure_channel(address, options=options), *interceptors)
+
+
+
 """
 The Pokemon Class
     - A Pokemon will attempt to evade capture by running away from the nearest trainer
 """
 class Pokemon():
 
-    def __init__(self, my_name):
+    STARTUP_TIMEOUT = 120               # How long to wait for the server to come up, in seconds
+
+    # address is where the server is listening, and interceptors are any gRPC client interceptors to wrap the channel in
+    # game is the id of the game to join on that server, empty for its default game
+    # board_size, if given, makes the pokemon keep a WorldCache of where every trainer is and pick its own moves,
+    #   instead of having the server play its turns through step
+    # channel, if given, is a channel shared with other clients in the same process, used in place of address and interceptors
+    def __init__(self, my_name, address="server:50051", interceptors=(), game="", board_size=None, channel=None):
         # Initialize variables
         self.name = my_name
+        self.address = address
+        self.game = game
+        self.interceptors = interceptors
+        self.channel = channel
         self.icon = ''
+        self.id = 0                         # The agent id the server gave this client, 0 if it gave none
         self.x_loc = -1
         self.y_loc = -1
+        self.captured_by = ''
+        self.done = threading.Event()      # Set once this pokemon is captured or the game is over
+        self.cache = WorldCache(board_size) if board_size is not None else None
+        self.listener = None                # The thread listening to this pokemon's event stream
+        return
+
+    # Takes the emoji and location the server gave this pokemon when it was registered
+    def registered(self, info):
+        self.icon = info.emojiID
+        self.id = info.id
+        self.x_loc = int(info.xLocation)
+        self.y_loc = int(info.yLocation)
+        return
+
+    # Listens to the events the server pushes to this pokemon until it is captured or the game ends
+    #   If the server goes away, the stream ends and run opens a new one once the pokemon has rejoined
+    def listen(self, stub):
+        lost = False
+        try:
+            subscription = pokemonou_pb2.Subscription(name=self.name, type="pokemon", positions=self.cache is not None, game=self.game)
+            for event in stub.subscribe(subscription):
+                if event.kind == "captured":
+                    self.captured_by = event.name
+                    self.done.set()
+                elif event.kind == "over":
+                    self.done.set()
+                elif self.cache is not None:
+                    self.cache.apply(event)
+        except grpc.RpcError as e:
+            # Either the server went away, or the channel was closed under the stream
+            lost = e.code() == grpc.StatusCode.UNAVAILABLE
+        finally:
+            # Without its stream a world cache goes stale, so the pokemon stops playing, unless it is about to rejoin
+            if self.cache is not None and not lost:
+                self.cache.synced.set()
+                self.done.set()
+        return
+
+    # Starts listening to the events the server pushes to this pokemon, unless the last stream is still open
+    def start_listening(self, stub):
+        if self.listener is not None and self.listener.is_alive():
+            return
+        if self.listener is not None and self.cache is not None:
+            self.cache.clear()
+        self.listener = threading.Thread(target=self.listen, args=(stub,), daemon=True)
+        self.listener.start()
+        return
+
+    # Registers this pokemon with the server again after the server went away, waiting for it to come back
+    #   A server restarted from a checkpoint hands back this pokemon's emoji and location, and one that never went away
+    #   turns the name down with the skull emoji, which leaves this pokemon as it was
+    def rejoin(self, stub):
+        info = stub.initialize_client(pokemonou_pb2.Name(name=self.name, type="pokemon", game=self.game),
+                                      wait_for_ready=True, timeout=self.STARTUP_TIMEOUT)
+        if info.emojiID != ":skull:":
+            self.registered(info)
+        self.start_listening(stub)
+        return
+
+    # Returns the call that plays a whole turn and its request - by agent id if the server gave one, which sends only the id,
+    #   otherwise by name
+    def turn_call(self, stub):
+        if self.id != 0:
+            return stub.agent_step, pokemonou_pb2.AgentId(id=self.id, game=self.game)
+        return stub.step, pokemonou_pb2.Name(name=self.name, type="pokemon", game=self.game)
+
+    # Plays a turn from the world cache - move 1 spot directly away from the nearest trainer, as seen locally
+    #   The server still checks the move, and answers with where the pokemon really is
+    def play_cached_turn(self, stub):
+        nearest = self.cache.nearest(self.x_loc, self.y_loc)
+        if nearest is None:
+            return
+
+        dx = (nearest[0] < self.x_loc) - (nearest[0] > self.x_loc)
+        dy = (nearest[1] < self.y_loc) - (nearest[1] > self.y_loc)
+        if self.id != 0:
+            loc = stub.agent_move(pokemonou_pb2.AgentMove(id=self.id, dx=dx, dy=dy, game=self.game))
+        else:
+            loc = stub.move(pokemonou_pb2.MoveInfo(name=pokemonou_pb2.Name(name=self.name, type="pokemon", game=self.game), emojiID=self.icon,
+                                                   oldloc=pokemonou_pb2.Location(x=self.x_loc, y=self.y_loc),
+                                                   newloc=pokemonou_pb2.Location(x=self.x_loc + dx, y=self.y_loc + dy)))
+        self.x_loc = loc.x
+        self.y_loc = loc.y
         return
 
     # The Pokemon's gameplay loop:
     #   If not captured, then run directly away from the nearest trainer until reaching a border
     def run(self):
-        with grpc.insecure_channel("server:50051") as channel:
+        with client_channel(self.address, self.interceptors, self.channel) as channel:
             stub = pokemonou_pb2_grpc.PokemonOUStub(channel)
 
             # Initialize this Pokemon with the server, and get an emoji designation and location
-            response = stub.initialize_client(pokemonou_pb2.Name(name=self.name, type="pokemon"))
-            self.icon = response.emojiID
-            self.x_loc = int(response.xLocation)
-            self.y_loc = int(response.yLocation)
+            #   Waits for the server to come up, and is skipped if the pokemon was registered along with the rest of its pack
+            if self.icon == '':
+                self.registered(stub.initialize_client(pokemonou_pb2.Name(name=self.name, type="pokemon", game=self.game),
+                                                       wait_for_ready=True, timeout=self.STARTUP_TIMEOUT))
+
+            # Listen for the server telling this pokemon it was captured, instead of polling for it
+            self.start_listening(stub)
+
+            # With a world cache, pick every move locally once the cache has every trainer's location
+            if self.cache is not None:
+                self.cache.synced.wait()
+                while(not self.done.is_set()):
+                    try:
+                        self.play_cached_turn(stub)
+                    except grpc.RpcError as e:
+                        # The server went away - carry on from wherever it puts this pokemon once it is back
+                        if e.code() != grpc.StatusCode.UNAVAILABLE:
+                            raise
+                        self.rejoin(stub)
+                        self.cache.synced.wait()
+                        continue
+                    self.done.wait(1)
+
+            play, turn = self.turn_call(stub)
 
             # Run away from Trainers and evade capture
-            is_game_over = False
-            while(not is_game_over):
-
-                # Check if this pokemon was captured
-                # Server returning the name 'free' denotes that the pokemon is free
-                captured_res = stub.captured(pokemonou_pb2.Name(name=self.name, type="pokemon"))
-                if captured_res.name != "free":
-
-                    # The pokemon is captured - show its trainer info and its path, then exit
-                    trainer_res = stub.show_trainer_info(pokemonou_pb2.Name(name=self.name, type="trainer"))
-                    path_res = stub.show_path(pokemonou_pb2.Name(name=self.name, type="pokemon"))
-                    return
-                
-                # Check where the nearest trainer is and move 1 spot in the opposite direction
-                check_res = stub.check_board(pokemonou_pb2.ClientInfo(name=self.name, emojiID=self.icon, xLocation=self.x_loc, yLocation=self.y_loc))
-
-                dx = 0
-                dy = 0
-                nx = check_res.x
-                ny = check_res.y
-
-                if nx < self.x_loc:
-                    dx = 1
-                elif nx > self.x_loc:
-                    dx = -1
-
-                if ny < self.y_loc:
-                    dy = 1
-                elif ny > self.y_loc:
-                    dy = -1
-
-                move_res = stub.move(pokemonou_pb2.MoveInfo(name=pokemonou_pb2.Name(name=self.name, type="pokemon"), 
-                                                            emojiID=self.icon, 
-                                                            oldloc=pokemonou_pb2.Location(x=self.x_loc, y=self.y_loc), 
-                                                            newloc=pokemonou_pb2.Location(x=self.x_loc+dx, y=self.y_loc+dy)))
+            while(not self.done.is_set()):
+
+                # Play a whole turn on the server - check if captured, then move 1 spot away from the nearest trainer
+                try:
+                    step_res = play(turn)
+                except grpc.RpcError as e:
+                    # The server went away - carry on from wherever it puts this pokemon once it is back
+                    if e.code() != grpc.StatusCode.UNAVAILABLE:
+                        raise
+                    self.rejoin(stub)
+                    play, turn = self.turn_call(stub)
+                    continue
+                if step_res.captured != "":
+                    self.captured_by = step_res.captured
+                    break
 
                 # Update the x and y coords
-                self.x_loc = move_res.x
-                self.y_loc = move_res.y
+                self.x_loc = step_res.loc.x
+                self.y_loc = step_res.loc.y
 
                 # Check the status of the game
-                status_res = stub.game_status(pokemonou_pb2.Name(name=self.name, type="trainer"))
-                is_game_over = status_res.status == "over"
+                if step_res.status == "over":
+                    break
+
+                # Wait for the next turn, waking up early if captured
+                # When the server owns the clock, step already waited for the tick to be played
+                if step_res.tick == 0:
+                    self.done.wait(1)
 
-                time.sleep(1)
+            if self.captured_by != "":
+                # The pokemon is captured - show its trainer info and its path, then exit
+                trainer_res = stub.show_trainer_info(pokemonou_pb2.Name(name=self.name, type="trainer", game=self.game))
+                path_res = stub.show_path(pokemonou_pb2.Name(name=self.name, type="pokemon", game=self.game))
 
         return
 
@@ -500,103 +2957,306 @@ The Trainer Class
 """
 class Trainer():
 
-    def __init__(self, my_name):
+    STARTUP_TIMEOUT = 120               # How long to wait for the server to come up, in seconds
+
+    # address is where the server is listening, and interceptors are any gRPC client interceptors to wrap the channel in
+    # game is the id of the game to join on that server, empty for its default game
+    # board_size, if given, makes the trainer keep a WorldCache of where every pokemon is and pick its own moves,
+    #   instead of having the server play its turns through step
+    # channel, if given, is a channel shared with other clients in the same process, used in place of address and interceptors
+    def __init__(self, my_name, address="server:50051", interceptors=(), game="", board_size=None, channel=None):
         # Initialize variables
         self.name = my_name
+        self.address = address
+        self.game = game
+        self.interceptors = interceptors
+        self.channel = channel
         self.icon = ''
+        self.id = 0                         # The agent id the server gave this client, 0 if it gave none
         self.x_loc = -1
         self.y_loc = -1
         self.pokedex = []
+        self.done = threading.Event()      # Set once the game is over
+        self.cache = WorldCache(board_size) if board_size is not None else None
+        self.listener = None                # The thread listening to this trainer's event stream
+        return
+
+    # Takes the emoji and location the server gave this trainer when it was registered
+    def registered(self, info):
+        self.icon = info.emojiID
+        self.id = info.id
+        self.x_loc = int(info.xLocation)
+        self.y_loc = int(info.yLocation)
+        return
+
+    # Listens to the events the server pushes to this trainer until the game ends
+    #   If the server goes away, the stream ends and run opens a new one once the trainer has rejoined
+    def listen(self, stub):
+        lost = False
+        try:
+            subscription = pokemonou_pb2.Subscription(name=self.name, type="trainer", positions=self.cache is not None, game=self.game)
+            for event in stub.subscribe(subscription):
+                if event.kind == "over":
+                    self.done.set()
+                elif self.cache is not None:
+                    self.cache.apply(event)
+        except grpc.RpcError as e:
+            # Either the server went away, or the channel was closed under the stream
+            lost = e.code() == grpc.StatusCode.UNAVAILABLE
+        finally:
+            # Without its stream a world cache goes stale, so the trainer stops playing, unless it is about to rejoin
+            if self.cache is not None and not lost:
+                self.cache.synced.set()
+                self.done.set()
+        return
+
+    # Starts listening to the events the server pushes to this trainer, unless the last stream is still open
+    def start_listening(self, stub):
+        if self.listener is not None and self.listener.is_alive():
+            return
+        if self.listener is not None and self.cache is not None:
+            self.cache.clear()
+        self.listener = threading.Thread(target=self.listen, args=(stub,), daemon=True)
+        self.listener.start()
+        return
+
+    # Registers this trainer with the server again after the server went away, waiting for it to come back
+    #   A server restarted from a checkpoint hands back this trainer's emoji and location, and one that never went away
+    #   turns the name down with the skull emoji, which leaves this trainer as it was
+    def rejoin(self, stub):
+        info = stub.initialize_client(pokemonou_pb2.Name(name=self.name, type="trainer", game=self.game),
+                                      wait_for_ready=True, timeout=self.STARTUP_TIMEOUT)
+        if info.emojiID != ":skull:":
+            self.registered(info)
+        self.start_listening(stub)
+        return
+
+    # Returns the call that plays a whole turn and its request - by agent id if the server gave one, which sends only the id,
+    #   otherwise by name
+    def turn_call(self, stub):
+        if self.id != 0:
+            return stub.agent_step, pokemonou_pb2.AgentId(id=self.id, game=self.game)
+        return stub.step, pokemonou_pb2.Name(name=self.name, type="trainer", game=self.game)
+
+    # Attempts a capture on the trainer's spot, and adds the pokemon to the pokedex if there was one
+    def try_capture(self, stub):
+        if self.id != 0:
+            result = stub.agent_capture(pokemonou_pb2.AgentId(id=self.id, game=self.game))
+        else:
+            result = stub.capture(pokemonou_pb2.ClientInfo(name=self.name, emojiID=self.icon, xLocation=self.x_loc, yLocation=self.y_loc,
+                                                           game=self.game))
+        if result.name == "failure":
+            return False
+
+        self.pokedex.append(result.name)
+        return True
+
+    # Plays a turn from the world cache - capture on this spot, otherwise move 1 spot towards the nearest pokemon
+    #   as seen locally and attempt a capture again
+    #   The server still checks the move and the captures
+    def play_cached_turn(self, stub):
+        if self.try_capture(stub):
+            return
+
+        nearest = self.cache.nearest(self.x_loc, self.y_loc)
+        if nearest is None:
+            return
+
+        dx = (nearest[0] > self.x_loc) - (nearest[0] < self.x_loc)
+        dy = (nearest[1] > self.y_loc) - (nearest[1] < self.y_loc)
+        if self.id != 0:
+            loc = stub.agent_move(pokemonou_pb2.AgentMove(id=self.id, dx=dx, dy=dy, game=self.game))
+        else:
+            loc = stub.move(pokemonou_pb2.MoveInfo(name=pokemonou_pb2.Name(name=self.name, type="trainer", game=self.game), emojiID=self.icon,
+                                                   oldloc=pokemonou_pb2.Location(x=self.x_loc, y=self.y_loc),
+                                                   newloc=pokemonou_pb2.Location(x=self.x_loc + dx, y=self.y_loc + dy)))
+        self.x_loc = loc.x
+        self.y_loc = loc.y
+
+        self.try_capture(stub)
         return
 
     # The Trainer gameplay loop:
     #   If a pokemon is at the current spot, capture it, if not move towards the nearest one and attempt one more capture
     def run(self):
-        with grpc.insecure_channel("server:50051") as channel:
+        with client_channel(self.address, self.interceptors, self.channel) as channel:
             stub = pokemonou_pb2_grpc.PokemonOUStub(channel)
 
             # Initialize this Pokemon with the server, and get an emoji designation and location
-            response = stub.initialize_client(pokemonou_pb2.Name(name=self.name, type="trainer"))
-            self.icon = response.emojiID
-            self.x_loc = int(response.xLocation)
-            self.y_loc = int(response.yLocation)
+            #   Waits for the server to come up, and is skipped if the trainer was registered along with the rest of its pack
+            if self.icon == '':
+                self.registered(stub.initialize_client(pokemonou_pb2.Name(name=self.name, type="trainer", game=self.game),
+                                                       wait_for_ready=True, timeout=self.STARTUP_TIMEOUT))
+
+            # Listen for the server announcing the end of the game, instead of polling for it
+            self.start_listening(stub)
+
+            # With a world cache, pick every move locally once the cache has every pokemon's location
+            if self.cache is not None:
+                self.cache.synced.wait()
+                while(not self.done.is_set()):
+                    try:
+                        self.play_cached_turn(stub)
+                    except grpc.RpcError as e:
+                        # The server went away - carry on from wherever it puts this trainer once it is back
+                        if e.code() != grpc.StatusCode.UNAVAILABLE:
+                            raise
+                        self.rejoin(stub)
+                        self.cache.synced.wait()
+                        continue
+                    self.done.wait(1)
+
+            play, turn = self.turn_call(stub)
 
             # Move and attempt to capture Pokemon
-            is_game_over = False
-            while(not is_game_over):
+            while(not self.done.is_set()):
+
+                # Play a whole turn on the server - capture on this spot, otherwise move towards the nearest pokemon and try again
+                try:
+                    step_res = play(turn)
+                except grpc.RpcError as e:
+                    # The server went away - carry on from wherever it puts this trainer once it is back
+                    if e.code() != grpc.StatusCode.UNAVAILABLE:
+                        raise
+                    self.rejoin(stub)
+                    play, turn = self.turn_call(stub)
+                    continue
+                if step_res.captured != "":
+                    self.pokedex.append(step_res.captured)
 
-                # Check if there is a Pokemon in this spot
-                capture_res = stub.capture(pokemonou_pb2.ClientInfo(name=self.name, emojiID=self.icon, xLocation=self.x_loc, yLocation=self.y_loc))
-                if capture_res.name == "failure":
-                    # No Pokemon was caught - move towards the nearest pokemon and attempt a capture again
-                    check_res = stub.check_board(pokemonou_pb2.ClientInfo(name=self.name, emojiID=self.icon, xLocation=self.x_loc, yLocation=self.y_loc))
+                # Update the x and y coords
+                self.x_loc = step_res.loc.x
+                self.y_loc = step_res.loc.y
 
-                    dx = 0
-                    dy = 0
+                # Check the status of the game
+                if step_res.status == "over":
+                    break
 
-                    nx = check_res.x
-                    ny = check_res.y
+                # Wait for the next turn, waking up early if the game ends
+                # When the server owns the clock, step already waited for the tick to be played
+                if step_res.tick == 0:
+                    self.done.wait(1)
 
-                    if nx < self.x_loc:
-                        dx = -1
-                    elif nx > self.x_loc:
-                        dx = 1
+            # Once the game is over, output this trainer's pokedex
+            pokedex_res = stub.show_pokedex(pokemonou_pb2.Name(name=self.name, type="trainer", game=self.game))
 
-                    if ny < self.y_loc:
-                        dy = -1
-                    elif ny > self.y_loc:
-                        dy = 1
+        return
 
-                    move_res = stub.move(pokemonou_pb2.MoveInfo(name=pokemonou_pb2.Name(name=self.name, type="trainer"), 
-                                                                emojiID=self.icon, 
-                                                                oldloc=pokemonou_pb2.Location(x=self.x_loc, y=self.y_loc), 
-                                                                newloc=pokemonou_pb2.Location(x=self.x_loc+dx, y=self.y_loc+dy)))
 
-                    # Update the x and y coords
-                    self.x_loc = move_res.x
-                    self.y_loc = move_res.y
 
-                    # Check if the Trainer can catch a Pokemon now
-                    capture2_res = stub.capture(pokemonou_pb2.ClientInfo(name=self.name, emojiID=self.icon, xLocation=self.x_loc, yLocation=self.y_loc))
+"""
+The Agent Pack class
 
+Runs many Trainers and Pokemon in one process, each on its own thread, all over one shared gRPC channel to the server
+Lets a worker container play any number of clients, so a big game needs a few workers instead of a container per client
+Every client in the pack is registered with one initialize_clients call before any of them starts playing
+"""
+class AgentPack():
 
-                # Check the status of the game
-                status_res = stub.game_status(pokemonou_pb2.Name(name=self.name, type="trainer"))
-                is_game_over = status_res.status == "over"
+    # trainers and pokemon are the names of the clients to run, and the other arguments are passed on to each of them
+    def __init__(self, trainers, pokemon, address="server:50051", interceptors=(), game="", board_size=None):
+        # Initialize variables
+        self.trainer_names = list(trainers)
+        self.pokemon_names = list(pokemon)
+        self.address = address
+        self.interceptors = interceptors
+        self.game = game
+        self.board_size = board_size
+        self.agents = []                    # The Trainer and Pokemon objects, once run has created them
+        return
 
-                time.sleep(1)
+    # Plays every client in the pack until all of them are done
+    def run(self):
+        with client_channel(self.address, self.interceptors) as channel:
+            self.agents = [Trainer(name, game=self.game, board_size=self.board_size, channel=channel) for name in self.trainer_names]
+            self.agents += [Pokemon(name, game=self.game, board_size=self.board_size, channel=channel) for name in self.pokemon_names]
 
-            # Once the game is over, output this trainer's pokedex
-            pokedex_res = stub.show_pokedex(pokemonou_pb2.Name(name=self.name, type="trainer"))
+            # Register the whole pack at once, waiting for the server to come up if it is not ready yet
+            stub = pokemonou_pb2_grpc.PokemonOUStub(channel)
+            names = [pokemonou_pb2.Name(name=name, type="trainer") for name in self.trainer_names]
+            names += [pokemonou_pb2.Name(name=name, type="pokemon") for name in self.pokemon_names]
+            infos = stub.initialize_clients(pokemonou_pb2.NameList(names=names, game=self.game), wait_for_ready=True,
+                                            timeout=Trainer.STARTUP_TIMEOUT)
+            for agent, info in zip(self.agents, infos.clients):
+                agent.registered(info)
+
+            threads = [threading.Thread(target=agent.run, daemon=True) for agent in self.agents]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
 
         return
 
 
+# Returns the client names in a range such as "0-9" (both ends included) with the given prefix, or none for an empty range
+def agent_names(prefix, span):
+    if span == "":
+        return []
+    first, _, last = span.partition("-")
+    return [f"{prefix}{i}" for i in range(int(first), int(last or first) + 1)]
+
+
+
+"""
+Reads the command-line arguments
+
+Only the board size and number of pokemon are required - every other setting is a named flag that is off unless given
+"""
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Runs a PokemonOU server, trainer, pokemon or worker, depending on the hostname')
+    parser.add_argument('board_size', type=int, help='size of the board')
+    parser.add_argument('num_pkmn', type=int, help='number of Pokemon')
+    parser.add_argument('--tick', type=float,
+                        help='length of a server-owned tick in seconds, 0 for lockstep - leave it off to let clients set their own pace')
+    parser.add_argument('--workers', type=int, default=8, help='number of worker threads the server uses for blocking game work')
+    parser.add_argument('--metrics', help='file the server keeps its metrics in, in the Prometheus text format')
+    parser.add_argument('--checkpoint', help='file the server checkpoints the game to, and resumes it from if it already exists')
+    parser.add_argument('--cache', action='store_true', help='have every client keep its own copy of the board and pick its own moves')
+    parser.add_argument('--plan-every', type=int, help='number of ticks between plans of which pokemon each trainer chases')
+    parser.add_argument('--flee', choices=PokemonOUGame.FLEE_STRATEGIES, default='nearest',
+                        help='how pokemon run - straight away from the nearest trainer, or steered by a distance field to every trainer')
+    parser.add_argument('--trainers', type=int,
+                        help='number of trainers to wait for - the game starts once they and every pokemon have connected')
+    return parser.parse_args()
+
+
 
 """
 Start of Program Logic
 
 Decides which class the machine belongs to, and runs that code
+Worker machines run a pack of clients - the TRAINERS and POKEMON environment variables give the range of each
+to run, such as TRAINERS=0-9 for trainer0 up to trainer9
 """
 
 if __name__ == '__main__':
     # Begin logging
     logging.basicConfig()
 
-    # Parse command-line arguments for size of board
-    boardsz = int(sys.argv[1])
-    num_pkmn = int(sys.argv[2])
+    # Parse the command-line arguments
+    args = parse_arguments()
+    boardsz = args.board_size
+    num_pkmn = args.num_pkmn
+
+    # With --cache, every client keeps its own copy of the board and picks its own moves, instead of calling step
+    board_size = boardsz if args.cache else None
 
     # Determine which class the program is
     hostname = re.sub(r'[0-9]', '', socket.gethostname())
 
     if hostname == 'server':
         server = Server()
-        server.serve(boardsize=boardsz, totalpkmn=num_pkmn)
+        server.serve(boardsize=boardsz, totalpkmn=num_pkmn, tick_interval=args.tick, max_workers=args.workers, metrics_file=args.metrics,
+                     checkpoint_file=args.checkpoint, plan_every=args.plan_every, flee=args.flee, num_trainers=args.trainers)
     elif hostname == 'trainer':
-        trainer = Trainer(my_name=socket.gethostname())
+        trainer = Trainer(my_name=socket.gethostname(), board_size=board_size)
         trainer.run()
     elif hostname == 'pokemon':
-        pokemon = Pokemon(my_name=socket.gethostname())
+        pokemon = Pokemon(my_name=socket.gethostname(), board_size=board_size)
         pokemon.run()
+    elif hostname == 'worker':
+        pack = AgentPack(agent_names("trainer", os.environ.get("TRAINERS", "")), agent_names("pokemon", os.environ.get("POKEMON", "")),
+                         board_size=board_size)
+        pack.run()
     
\ No newline at end of file
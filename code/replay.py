@@ -0,0 +1,120 @@
+import array
+import re
+import sys
+import time
+
+from node import ActionLog, PokemonOUGame
+
+
+"""
+The Replay class
+
+Re-plays a game offline from a checkpoint written by the server, with no gRPC, no clients and no waiting between turns
+The checkpoint holds the game's seed, and along with the log file kept next to it, its whole action log
+Every logged connect, move and capture is applied to a fresh PokemonOUGame in order, through the same functions the server used
+
+Every action is checked as it is replayed:
+    - Clients must connect on the spot they were logged on, and moves and captures must have the same outcome
+    - Once every action is replayed, every location, path, pokedex and owner must match the checkpoint
+"""
+class Replay():
+
+    # actions is every action the checkpoint covers, packed as bytes, as returned by PokemonOUGame.read_checkpoint_actions
+    def __init__(self, state, actions):
+        self.state = state
+        self.game = PokemonOUGame(board_size=state["board_size"], total_pkmn=state["num_pkmn"], seed=state["seed"])
+
+        self.names, _ = state["actors"]
+        self.rows = array.array('i')
+        self.rows.frombytes(actions)
+
+        self.replayed = 0                   # The number of actions replayed so far
+        self.failures = []                  # List of problems found (strings)
+        return
+
+    # Replays the first count actions (every action if count is None), and returns the actions replayed per second
+    def run(self, count=None):
+        game = self.game
+        fields = ActionLog.FIELDS
+        total = len(self.rows) // fields if count is None else min(count, len(self.rows) // fields)
+
+        start = time.perf_counter()
+        for i in range(self.replayed, total):
+            tick, actor, kind, fx, fy, tx, ty, target = self.rows[i * fields:(i + 1) * fields]
+            name = self.names[actor]
+            type = re.sub(r'[0-9]', '', name)
+            kind = ActionLog.KINDS[kind]
+
+            if kind == "connect":
+                game.icons[name] = self.state["icons"][name]
+                spot = game.place_client(type, name, tx, ty)
+                if spot != (tx, ty):
+                    self.failures.append(f"action {i}: {name} could not connect on ({tx}, {ty})")
+
+            elif kind == "move":
+                clients = game.trainers if type == "trainer" else game.pokemon
+                if clients.get(name) != (fx, fy):
+                    self.failures.append(f"action {i}: {name} was at {clients.get(name)} instead of ({fx}, {fy})")
+                loc = game.move_client(type, name, game.icons[name], tx, ty)
+                if loc != (tx, ty):
+                    self.failures.append(f"action {i}: {name} could not move to ({tx}, {ty})")
+
+            else:
+                pokemon = game.capture_at(name, game.icons[name], tx, ty)
+                if pokemon != self.names[target]:
+                    self.failures.append(f"action {i}: {name} captured {pokemon} instead of {self.names[target]}")
+
+        elapsed = time.perf_counter() - start
+        done = total - self.replayed
+        self.replayed = total
+
+        return done / elapsed if elapsed > 0 else float('inf')
+
+    # Checks the replayed game against the state stored in the checkpoint - only meaningful once every action is replayed
+    def check(self):
+        game = self.game
+        state = self.state
+
+        if game.trainers != state["trainers"] or game.pokemon != state["pokemon"]:
+            self.failures.append("the replayed locations differ from the checkpoint")
+        if game.trainer_pokedexes != state["pokedexes"] or game.owners != state["owners"]:
+            self.failures.append("the replayed pokedexes differ from the checkpoint")
+        for paths, packed in ((game.trainer_paths, state["trainer_paths"]), (game.pokemon_paths, state["pokemon_paths"])):
+            if {name: path.tobytes() for name, path in paths.items()} != packed:
+                self.failures.append("the replayed paths differ from the checkpoint")
+        if game.capture_counter != state["capture_counter"]:
+            self.failures.append(f"{game.capture_counter} captures were replayed, the checkpoint has {state['capture_counter']}")
+
+        return self.failures
+
+
+
+"""
+Start of Program Logic
+
+Usage: python replay.py <checkpoint file> [number of actions] [board]
+
+Replays every action in the checkpoint, or only the first few given, and checks them against what the server logged
+Passing board as the last argument prints the board as it was after the last replayed action
+"""
+
+if __name__ == '__main__':
+    state = PokemonOUGame.read_checkpoint(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] != "board" else None
+
+    replay = Replay(state, PokemonOUGame.read_checkpoint_actions(sys.argv[1], state))
+    actions_per_sec = replay.run(count)
+    if count is None:
+        replay.check()
+
+    if sys.argv[-1] == "board":
+        replay.game.print_board()
+
+    print(f"Replayed {replay.replayed} of {len(replay.rows) // ActionLog.FIELDS} actions ({actions_per_sec:.0f} per second)")
+    print(f"{replay.game.capture_counter} of {state['num_pkmn']} pokemon captured, seed {state['seed']}")
+    if len(replay.failures) == 0:
+        print("OK")
+    else:
+        for failure in replay.failures[:20]:
+            print("MISMATCH: " + failure)
+        sys.exit(1)
@@ -0,0 +1,558 @@
+import asyncio
+import bisect
+import math
+import random
+import re
+import subprocess
+import sys
+
+import grpc
+import pokemonou_pb2
+import pokemonou_pb2_grpc
+from node import Server
+
+
+"""
+The Shard Map class
+
+Splits the board into num_shards rectangular tiles, as close to square as the number of shards allows
+Tile i covers the cells with x0 <= x < x1 and y0 <= y < y1, where (x0, y0, x1, y1) = tile(i)
+"""
+class ShardMap():
+
+    def __init__(self, board_size, num_shards):
+        self.board_size = board_size
+        self.num_shards = num_shards
+
+        # The most rows of tiles that still divide the shards evenly, without having more rows than columns
+        self.rows = max(r for r in range(1, math.isqrt(num_shards) + 1) if num_shards % r == 0)
+        self.cols = num_shards // self.rows
+        if self.cols > board_size:
+            raise ValueError(f"a {board_size}x{board_size} board cannot be split into {num_shards} shards")
+
+        self.xs = [board_size * r // self.rows for r in range(self.rows + 1)]
+                                            # List of the x coordinates where each row of tiles starts, and the board's end
+        self.ys = [board_size * c // self.cols for c in range(self.cols + 1)]
+                                            # List of the y coordinates where each column of tiles starts, and the board's end
+        return
+
+    # Returns the (x0, y0, x1, y1) corners of a shard's tile
+    def tile(self, shard):
+        r, c = divmod(shard, self.cols)
+        return (self.xs[r], self.ys[c], self.xs[r + 1], self.ys[c + 1])
+
+    # Returns the shard whose tile holds (x, y)
+    def shard_of(self, x, y):
+        return (bisect.bisect_right(self.xs, x) - 1) * self.cols + bisect.bisect_right(self.ys, y) - 1
+
+    # Returns the squared distance from (x, y) to the closest cell of a shard's tile
+    def distance2(self, shard, x, y):
+        x0, y0, x1, y1 = self.tile(shard)
+        dx = max(x0 - x, 0, x - (x1 - 1))
+        dy = max(y0 - y, 0, y - (y1 - 1))
+        return dx * dx + dy * dy
+
+
+
+"""
+The Shard Router class
+
+Serves the PokemonOU service to clients when the board is split across several shard servers, each running the
+default game of a node.py Server with its own tile of the board
+Clients only ever talk to the router, which sends each call to the shard that owns the client's tile:
+    - A move across a tile border is a handoff - the client is released from its shard and admitted by the next one,
+      along with its emoji, path and pokedex
+    - check_board asks the client's own shard first, then only the other shards whose tile could hold something closer
+    - Captures, game status and event streams are tracked by the router, since no single shard sees the whole game
+
+The router runs entirely on its event loop, so its own dicts need no locks
+The shard services (admit, release and nearest) are left unimplemented, since only shards answer them
+"""
+class ShardRouter(pokemonou_pb2_grpc.PokemonOUServicer):
+
+    def __init__(self, board_size, total_pkmn, addresses):
+
+        # Initialize variables
+        self.status = "active"
+        self.board_size = board_size
+        self.num_pkmn = total_pkmn
+        self.capture_counter = 0
+        self.handoffs = 0
+        self.cross_shard_queries = 0
+
+        self.map = ShardMap(board_size, len(addresses))
+        self.channels = [grpc.aio.insecure_channel(address) for address in addresses]
+        self.shards = [pokemonou_pb2_grpc.PokemonOUStub(channel) for channel in self.channels]
+
+        self.types = {}                     # Dict: key = client's name (string), value = "trainer" or "pokemon" (string)
+        self.icons = {}                     # Dict: key = client's name (string), value = emoji assigned to that client (string)
+        self.shard_of = {}                  # Dict: key = client's name (string), value = index of the shard that holds it (int)
+        self.locations = {}                 # Dict: key = client's name (string), value = current location ((int, int) tuple)
+                                            # Clients leave this dict once captured
+        self.owners = {}                    # Dict: key = captured pokemon's name (string), value = trainer that caught it (string)
+
+        # Event streams opened by clients through subscribe
+        self.subscribers = {}               # Dict: key = client's name (string), value = list of event queues ([asyncio.Queue])
+        self.position_subscribers = {"trainer": [], "pokemon": []}
+                                            # Dict: key = client type (string), value = queues that also want opponent positions
+
+        # Shuffled lists of the emojis nobody is using yet, read from the same files as a single server
+        with open('people_emoji_list.txt', 'r') as p:
+            self.free_people_emojis = [line.strip() for line in p]
+        with open('animal_emoji_list.txt', 'r') as a:
+            self.free_animal_emojis = [line.strip() for line in a]
+        random.shuffle(self.free_people_emojis)
+        random.shuffle(self.free_animal_emojis)
+
+        return
+
+    # Waits until every shard is up and serving
+    async def connect(self):
+        await asyncio.gather(*(channel.channel_ready() for channel in self.channels))
+        return
+
+    async def close(self):
+        await asyncio.gather(*(channel.close() for channel in self.channels))
+        return
+
+    # Returns the current value of every router gauge, by name
+    def gauges(self):
+        gauges = {
+            "trainers": sum(1 for name in self.locations if self.types[name] == "trainer"),
+            "free_pokemon": sum(1 for name in self.locations if self.types[name] == "pokemon"),
+            "captures_total": self.capture_counter,
+            "handoffs_total": self.handoffs,
+            "cross_shard_queries_total": self.cross_shard_queries,
+            "shards": len(self.shards),
+        }
+        for shard in range(len(self.shards)):
+            gauges[f"shard{shard}_live_clients"] = sum(1 for name in self.locations if self.shard_of[name] == shard)
+        return gauges
+
+    # Pushes an event to every stream the client has open
+    def publish(self, name, event):
+        for events in self.subscribers.get(name, []):
+            events.put_nowait(event)
+        return
+
+    # Pushes an event to every subscriber of the opposite type that asked for positions
+    def publish_to_opponents(self, type, event):
+        for events in self.position_subscribers["pokemon" if type == "trainer" else "trainer"]:
+            events.put_nowait(event)
+        return
+
+    # Returns the location of the nearest client of the opposite type anywhere on the board, or None if there are none
+    #   Only shards whose tile is no further away than the best match so far are asked
+    async def nearest_opponent(self, name, x, y):
+        query = pokemonou_pb2.ClientInfo(name=name, xLocation=x, yLocation=y)
+        own = self.map.shard_of(x, y)
+
+        best = None
+        best_d2 = math.inf
+        loc = await self.shards[own].nearest(query)
+        if loc.x >= 0:
+            best = (loc.x, loc.y)
+            best_d2 = (loc.x - x)**2 + (loc.y - y)**2
+
+        # Ask every other shard that could still hold something at least as close, all at once
+        others = [shard for shard in range(len(self.shards)) if shard != own and self.map.distance2(shard, x, y) <= best_d2]
+        if len(others) == 0:
+            return best
+        self.cross_shard_queries += 1
+
+        for loc in await asyncio.gather(*(self.shards[shard].nearest(query) for shard in others)):
+            if loc.x < 0:
+                continue
+            d2 = (loc.x - x)**2 + (loc.y - y)**2
+            if d2 < best_d2:
+                best = (loc.x, loc.y)
+                best_d2 = d2
+
+        return best
+
+    # Admits a client on the first shard in the list with an empty spot anywhere on its tile
+    #   Returns the admitted client's state and the shard's index, or (None, None) if every listed shard is full
+    async def admit_anywhere(self, state, shards):
+        state.anywhere = True
+        for shard in shards:
+            admitted = await self.shards[shard].admit(state)
+            if admitted.name != "":
+                return admitted, shard
+        return None, None
+
+    # Moves a client to (nx, ny) if the move is legal, handing it to the next shard if it crosses a tile border
+    #   Returns the client's location afterwards, or None if it is not on the board (unregistered or already captured)
+    async def move_client(self, name, nx, ny):
+        old_loc = self.locations.get(name)
+        if old_loc is None:
+            return None
+        type = self.types[name]
+
+        # Keep the move on the board
+        nx = min(max(nx, 0), self.board_size - 1)
+        ny = min(max(ny, 0), self.board_size - 1)
+
+        src = self.shard_of[name]
+        dst = self.map.shard_of(nx, ny)
+
+        if src == dst:
+            loc = await self.shards[src].move(pokemonou_pb2.MoveInfo(name=pokemonou_pb2.Name(name=name, type=type), emojiID=self.icons[name],
+                                                                     oldloc=pokemonou_pb2.Location(x=old_loc[0], y=old_loc[1]),
+                                                                     newloc=pokemonou_pb2.Location(x=nx, y=ny)))
+            new_loc = (loc.x, loc.y)
+
+        else:
+            # Take the client off its shard - if it is not there, it was captured before it could leave
+            state = await self.shards[src].release(pokemonou_pb2.Name(name=name, type=type))
+            if state.name == "":
+                return None
+
+            state.loc.x, state.loc.y = nx, ny
+            admitted = await self.shards[dst].admit(state)
+            if admitted.name != "":
+                self.handoffs += 1
+            else:
+                # The spot across the border is taken - go back to the old spot, or anywhere if that was taken meanwhile
+                dst = src
+                state.loc.x, state.loc.y = old_loc
+                admitted = await self.shards[src].admit(state)
+                if admitted.name == "":
+                    admitted, dst = await self.admit_anywhere(state, [src] + [s for s in range(len(self.shards)) if s != src])
+                    if admitted is None:
+                        del self.locations[name]
+                        return None
+
+            self.shard_of[name] = dst
+            new_loc = (admitted.loc.x, admitted.loc.y)
+
+        # The client was captured while the move was being made
+        if name not in self.locations:
+            return None
+
+        if new_loc != old_loc:
+            self.locations[name] = new_loc
+            self.publish_to_opponents(type, pokemonou_pb2.Event(kind="position", name=name, loc=pokemonou_pb2.Location(x=new_loc[0], y=new_loc[1])))
+
+        return new_loc
+
+    # Captures the pokemon on the trainer's spot, and returns its name or None if the spot has no pokemon
+    async def capture_at(self, name, x, y):
+        shard = self.shard_of[name]
+        result = await self.shards[shard].capture(pokemonou_pb2.ClientInfo(name=name, emojiID=self.icons[name], xLocation=x, yLocation=y))
+        if result.name == "failure":
+            return None
+
+        # Record the capture, then tell the pokemon who caught it and the trainers watching positions that it left the board
+        pokemon = result.name
+        self.owners[pokemon] = name
+        self.locations.pop(pokemon, None)
+        self.capture_counter += 1
+
+        self.publish(pokemon, pokemonou_pb2.Event(kind="captured", name=name))
+        self.publish_to_opponents("pokemon", pokemonou_pb2.Event(kind="removed", name=pokemon))
+
+        # Capturing the last pokemon ends the game
+        if self.capture_counter == self.num_pkmn:
+            self.status = "over"
+            for queues in self.subscribers.values():
+                for events in queues:
+                    events.put_nowait(pokemonou_pb2.Event(kind="over"))
+
+        return pokemon
+
+    # Returns the shard that holds (or last held) a client, so calls about it can be sent there
+    def shard_for(self, name):
+        return self.shards[self.shard_of.get(name, 0)]
+
+
+    """
+    Client Functions
+    """
+
+    async def game_status(self, request, context):
+        return pokemonou_pb2.GameStatus(status=self.status)
+
+    # Returns the router's gauges - each shard also serves its own stats
+    async def stats(self, request, context):
+        return pokemonou_pb2.Stats(gauges=self.gauges())
+
+    # Registers a client, allocates it an emoji, and admits it on a random shard with room for it
+    async def initialize_client(self, request, context):
+        refused = pokemonou_pb2.ClientInfo(name=request.name, emojiID=":skull:", xLocation=-1, yLocation=-1)
+
+        if request.name in self.icons:
+            return refused
+        if request.type == "trainer":
+            free = self.free_people_emojis
+        elif request.type == "pokemon":
+            free = self.free_animal_emojis
+        else:
+            return refused
+
+        if len(free) == 0:
+            return self.refuse_client(request, context, f"every {request.type} emoji is already in use")
+
+        # Reserve the name and the emoji before waiting on the shards, so a second registration under it is turned away
+        _emoji = free.pop()
+        self.icons[request.name] = _emoji
+
+        shards = random.sample(range(len(self.shards)), len(self.shards))
+        state = pokemonou_pb2.ClientState(name=request.name, type=request.type, emojiID=_emoji)
+        admitted, shard = await self.admit_anywhere(state, shards)
+        if admitted is None:
+            free.append(_emoji)
+            del self.icons[request.name]
+            return self.refuse_client(request, context, "every spot on the board is already taken")
+
+        x, y = admitted.loc.x, admitted.loc.y
+        self.types[request.name] = request.type
+        self.shard_of[request.name] = shard
+        self.locations[request.name] = (x, y)
+        self.publish_to_opponents(request.type, pokemonou_pb2.Event(kind="position", name=request.name, loc=pokemonou_pb2.Location(x=x, y=y)))
+
+        return pokemonou_pb2.ClientInfo(name=request.name, emojiID=_emoji, xLocation=x, yLocation=y)
+
+    # Registers many clients in one call as initialize_client does, all at once, and returns them in the order they were given
+    async def initialize_clients(self, request, context):
+        clients = await asyncio.gather(*(self.initialize_client(name, None) for name in request.names))
+        return pokemonou_pb2.ClientInfoList(clients=clients)
+
+    # Turns a client away - the call fails with RESOURCE_EXHAUSTED, unless it is part of a batch (context is None)
+    def refuse_client(self, request, context, reason):
+        if context is not None:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(f"{request.name} could not connect: {reason}")
+        return pokemonou_pb2.ClientInfo(name=request.name, emojiID=":skull:", xLocation=-1, yLocation=-1)
+
+    # Returns the location of the nearest client of the opposite type, across every shard
+    async def check_board(self, request, context):
+        type = re.sub(r'[0-9]', '', request.name)
+        if type != "trainer" and type != "pokemon":
+            return pokemonou_pb2.Location(x=-1, y=-1)
+
+        nearest = await self.nearest_opponent(request.name, request.xLocation, request.yLocation)
+        if nearest is None:
+            return pokemonou_pb2.Location(x=request.xLocation, y=request.yLocation)
+
+        return pokemonou_pb2.Location(x=nearest[0], y=nearest[1])
+
+    async def move(self, request, context):
+        new_loc = await self.move_client(request.name.name, request.newloc.x, request.newloc.y)
+
+        # The client is not on the board - leave it where it claims to be
+        if new_loc is None:
+            return pokemonou_pb2.Location(x=request.oldloc.x, y=request.oldloc.y)
+
+        return pokemonou_pb2.Location(x=new_loc[0], y=new_loc[1])
+
+    async def show_path(self, request, context):
+        return await self.shard_for(request.name).show_path(request)
+
+    async def path_slice(self, request, context):
+        return await self.shard_for(request.name).path_slice(request)
+
+    # Plays a whole turn for a client, the same way PokemonOUGame.play_turn does on a single server
+    async def step(self, request, context):
+        name = request.name
+        captured = ""
+        loc = self.locations.get(name)
+
+        if request.type == "trainer" and loc is not None and self.types[name] == "trainer":
+            pokemon = await self.capture_at(name, loc[0], loc[1])
+            if pokemon is None:
+                # No Pokemon was caught - move towards the nearest pokemon and attempt a capture again
+                nearest = await self.nearest_opponent(name, loc[0], loc[1])
+                if nearest is not None:
+                    dx = (nearest[0] > loc[0]) - (nearest[0] < loc[0])
+                    dy = (nearest[1] > loc[1]) - (nearest[1] < loc[1])
+                    loc = await self.move_client(name, loc[0] + dx, loc[1] + dy)
+
+                if loc is not None:
+                    pokemon = await self.capture_at(name, loc[0], loc[1])
+
+            if pokemon is not None:
+                captured = pokemon
+
+        elif request.type == "pokemon" and self.types.get(name) == "pokemon":
+            if loc is not None:
+
+                # Check where the nearest trainer is and move 1 spot in the opposite direction
+                nearest = await self.nearest_opponent(name, loc[0], loc[1])
+                if nearest is not None:
+                    dx = (nearest[0] < loc[0]) - (nearest[0] > loc[0])
+                    dy = (nearest[1] < loc[1]) - (nearest[1] > loc[1])
+                    loc = await self.move_client(name, loc[0] + dx, loc[1] + dy)
+
+            if loc is None:
+                captured = self.owners.get(name, "")
+
+        else:
+            loc = None
+
+        if loc is None:
+            loc = (-1, -1)
+        return pokemonou_pb2.StepResult(status=self.status, loc=pokemonou_pb2.Location(x=loc[0], y=loc[1]), captured=captured)
+
+    # Streams captured, over, position and removed events to a client, the same way PokemonOUGame.subscribe does
+    async def subscribe(self, request, context):
+        events = asyncio.Queue()
+        self.subscribers.setdefault(request.name, []).append(events)
+
+        # Start with a snapshot of every opponent's location
+        if request.positions and request.type in self.position_subscribers:
+            opponent = "pokemon" if request.type == "trainer" else "trainer"
+            for name, loc in self.locations.items():
+                if self.types[name] == opponent:
+                    events.put_nowait(pokemonou_pb2.Event(kind="position", name=name, loc=pokemonou_pb2.Location(x=loc[0], y=loc[1])))
+            events.put_nowait(pokemonou_pb2.Event(kind="synced"))
+            self.position_subscribers[request.type].append(events)
+
+        # Catch the client up on anything that already happened before it subscribed
+        if request.type == "pokemon" and request.name in self.owners:
+            events.put_nowait(pokemonou_pb2.Event(kind="captured", name=self.owners[request.name]))
+        if self.status == "over":
+            events.put_nowait(pokemonou_pb2.Event(kind="over"))
+
+        # The stream is cancelled if the client goes away
+        try:
+            while True:
+                event = await events.get()
+                yield event
+
+                if event.kind == "over" or (event.kind == "captured" and request.type == "pokemon"):
+                    break
+        finally:
+            self.subscribers[request.name].remove(events)
+            if len(self.subscribers[request.name]) == 0:
+                del self.subscribers[request.name]
+            if events in self.position_subscribers.get(request.type, []):
+                self.position_subscribers[request.type].remove(events)
+
+        return
+
+    # Sharded games are laid out when the shards start, so they cannot be created or ended through the router
+    async def create_game(self, request, context):
+        await context.abort(grpc.StatusCode.UNIMPLEMENTED, "a sharded server hosts exactly one game")
+
+    async def end_game(self, request, context):
+        await context.abort(grpc.StatusCode.UNIMPLEMENTED, "a sharded server hosts exactly one game")
+
+
+    """
+    Trainer Functions
+    """
+
+    # Captures on the trainer's own spot - the spot in the request is only trusted if it is the trainer's current one
+    async def capture(self, request, context):
+        loc = self.locations.get(request.name)
+        if loc is None or self.types[request.name] != "trainer" or loc != (request.xLocation, request.yLocation):
+            return pokemonou_pb2.Name(name="failure", type="pokemon")
+
+        pokemon = await self.capture_at(request.name, loc[0], loc[1])
+        if pokemon is None:
+            return pokemonou_pb2.Name(name="failure", type="pokemon")
+
+        return pokemonou_pb2.Name(name=pokemon, type="pokemon")
+
+    async def show_pokedex(self, request, context):
+        return await self.shard_for(request.name).show_pokedex(request)
+
+
+    """
+    Pokemon Functions
+    """
+
+    async def captured(self, request, context):
+        trainer = self.owners.get(request.name)
+        if trainer is not None:
+            return pokemonou_pb2.Name(name=trainer, type="trainer")
+
+        return pokemonou_pb2.Name(name="free", type="")
+
+    # Shown by the shard the pokemon was captured on, which also recorded its owner
+    async def show_trainer_info(self, request, context):
+        return await self.shard_for(request.name).show_trainer_info(request)
+
+
+
+# Runs one shard of a sharded board - the default game of a node.py Server, owning one tile
+async def run_shard(boardsize, totalpkmn, port, index, count, max_workers=8):
+    tile = ShardMap(boardsize, count).tile(index)
+
+    server = Server()
+    await server.start_async(boardsize, totalpkmn, None, max_workers, address=f'[::]:{port}', tile=tile)
+    print(f"Shard {index} of {count} serving tile {tile} on port {port}")
+
+    try:
+        await server.server.wait_for_termination()
+    finally:
+        await server.stop_async()
+    return
+
+# Runs the router clients connect to, in front of the shards listening on addresses
+async def run_router(boardsize, totalpkmn, port, addresses):
+    router = ShardRouter(boardsize, totalpkmn, addresses)
+    await router.connect()
+
+    server = grpc.aio.server()
+    pokemonou_pb2_grpc.add_PokemonOUServicer_to_server(router, server)
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    print(f"Router serving {len(addresses)} shards on port {port}")
+
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+        await router.close()
+    return
+
+
+
+"""
+Start of Program Logic
+
+Usage:
+    python shard.py shard <board size> <number of pokemon> <port> <shard index> <number of shards> [workers]
+    python shard.py router <board size> <number of pokemon> <port> <shard address> [<shard address> ...]
+    python shard.py local <board size> <number of pokemon> <number of shards> [port]
+
+Every shard and the router must be given the same board size and number of pokemon, and the router must list the
+shards in index order
+local starts every shard as its own process on the ports after port (50051 by default), and serves the router on port
+"""
+
+if __name__ == '__main__':
+    mode = sys.argv[1]
+    boardsz = int(sys.argv[2])
+    num_pkmn = int(sys.argv[3])
+
+    try:
+        if mode == "shard":
+            max_workers = int(sys.argv[7]) if len(sys.argv) > 7 else 8
+            asyncio.run(run_shard(boardsz, num_pkmn, int(sys.argv[4]), int(sys.argv[5]), int(sys.argv[6]), max_workers))
+
+        elif mode == "router":
+            asyncio.run(run_router(boardsz, num_pkmn, int(sys.argv[4]), sys.argv[5:]))
+
+        elif mode == "local":
+            num_shards = int(sys.argv[4])
+            port = int(sys.argv[5]) if len(sys.argv) > 5 else 50051
+
+            # One process per shard, so each one gets a core and an interpreter lock of its own
+            shards = [subprocess.Popen([sys.executable, __file__, "shard", str(boardsz), str(num_pkmn), str(port + 1 + i), str(i), str(num_shards)])
+                      for i in range(num_shards)]
+            try:
+                asyncio.run(run_router(boardsz, num_pkmn, port, [f"localhost:{port + 1 + i}" for i in range(num_shards)]))
+            finally:
+                for process in shards:
+                    process.terminate()
+                for process in shards:
+                    process.wait()
+
+        else:
+            print(f"Unknown mode '{mode}' - use shard, router or local")
+            sys.exit(1)
+
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,212 @@
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+import pokemonou_pb2
+from node import PokemonOUGame
+
+
+"""
+Stress test for the region locking in PokemonOUGame
+
+Registers trainers and pokemon on a small, crowded board, then has one thread per client hammer the game with
+move, capture and step calls for a fixed amount of time, while reader threads keep calling check_board, captured
+and snapshot_board. Every client is only ever driven by its own thread, so each thread knows exactly which of its
+moves went through and which pokemon it caught.
+
+Once every thread has stopped, the game state is checked for:
+    - Lost moves: every path must hold exactly one entry per accepted move, each one cell from the last
+    - Double captures: no pokemon may be reported captured twice, or appear in two pokedexes
+    - Torn state: the occupancy maps, spatial indexes, client dicts and the board must all agree
+"""
+class StressTest():
+
+    def __init__(self, board_size, num_trainers, num_pkmn, seconds, region_size=None):
+        self.game = PokemonOUGame(board_size=board_size, total_pkmn=num_pkmn, region_size=region_size)
+        self.num_trainers = num_trainers
+        self.num_pkmn = num_pkmn
+        self.seconds = seconds
+
+        self.accepted_moves = {}            # Dict: key = client's name (string), value = number of moves the server accepted
+        self.captures = []                  # List of (trainer, pokemon) pairs reported by capture and step
+        self.failures = []                  # List of problems found (strings)
+        self.stop = threading.Event()
+        return
+
+    # Moves one client around at random, sometimes through move and sometimes through step
+    def drive(self, name, type, seed):
+        rng = random.Random(seed)
+        game = self.game
+        accepted = 0
+        captures = []
+
+        try:
+            while not self.stop.is_set():
+                clients = game.trainers if type == "trainer" else game.pokemon
+                loc = clients.get(name)
+                if loc is None:
+                    break
+
+                if rng.random() < 0.2:
+                    # A whole turn - count it as a move if the client's path grew
+                    paths = game.trainer_paths if type == "trainer" else game.pokemon_paths
+                    before = len(paths[name])
+                    result = game.step(pokemonou_pb2.Name(name=name, type=type), None)
+                    accepted += len(paths[name]) - before
+                    if type == "trainer" and result.captured != "":
+                        captures.append((name, result.captured))
+                    continue
+
+                # A random step in any direction, then a capture attempt for trainers
+                nx = loc[0] + rng.randint(-1, 1)
+                ny = loc[1] + rng.randint(-1, 1)
+                new_loc = game.move_client(type, name, game.icons[name], nx, ny)
+                target = (min(max(nx, 0), game.board_size - 1), min(max(ny, 0), game.board_size - 1))
+                if new_loc is not None and new_loc == target:
+                    accepted += 1
+
+                if type == "trainer" and new_loc is not None:
+                    pokemon = game.capture_at(name, game.icons[name], new_loc[0], new_loc[1])
+                    if pokemon is not None:
+                        captures.append((name, pokemon))
+        except Exception as e:
+            self.failures.append(f"{name} raised {e!r}")
+
+        self.accepted_moves[name] = accepted
+        self.captures.extend(captures)
+        return
+
+    # Keeps reading the game while it is being changed
+    def read(self, seed):
+        rng = random.Random(seed)
+        game = self.game
+
+        try:
+            while not self.stop.is_set():
+                x = rng.randint(0, game.board_size - 1)
+                y = rng.randint(0, game.board_size - 1)
+                game.check_board(pokemonou_pb2.ClientInfo(name="trainer0", xLocation=x, yLocation=y), None)
+                game.check_board(pokemonou_pb2.ClientInfo(name="pokemon0", xLocation=x, yLocation=y), None)
+                game.captured(pokemonou_pb2.Name(name=f"pokemon{rng.randrange(self.num_pkmn)}", type="pokemon"), None)
+
+                # A snapshot must never show the same client in two places
+                board = game.snapshot_board()
+                icons = board[board != 0]
+                if len(icons) != len(np.unique(icons)):
+                    self.failures.append("snapshot_board showed a client in two places")
+        except Exception as e:
+            self.failures.append(f"reader raised {e!r}")
+        return
+
+    # Runs the test and returns the list of problems found
+    def run(self, num_readers=2):
+        game = self.game
+
+        for i in range(self.num_trainers):
+            game.initialize_client(pokemonou_pb2.Name(name=f"trainer{i}", type="trainer"), None)
+        for i in range(self.num_pkmn):
+            game.initialize_client(pokemonou_pb2.Name(name=f"pokemon{i}", type="pokemon"), None)
+
+        threads = [threading.Thread(target=self.drive, args=(name, "trainer", i)) for i, name in enumerate(list(game.trainers))]
+        threads += [threading.Thread(target=self.drive, args=(name, "pokemon", -i - 1)) for i, name in enumerate(list(game.pokemon))]
+        threads += [threading.Thread(target=self.read, args=(1000 + i,)) for i in range(num_readers)]
+
+        for t in threads:
+            t.start()
+        time.sleep(self.seconds)
+        self.stop.set()
+        for t in threads:
+            t.join()
+
+        self.check()
+        return self.failures
+
+    # Checks the final game state against what the client threads saw
+    def check(self):
+        game = self.game
+
+        # Lost moves - one path entry per accepted move, and every step at most one cell long
+        for name, path in list(game.trainer_paths.items()) + list(game.pokemon_paths.items()):
+            if len(path) - 1 != self.accepted_moves.get(name, 0):
+                self.failures.append(f"{name} made {self.accepted_moves.get(name, 0)} moves but its path has {len(path) - 1}")
+            for (ax, ay), (bx, by) in zip(path, path[1:]):
+                if abs(ax - bx) > 1 or abs(ay - by) > 1:
+                    self.failures.append(f"{name} jumped from ({ax}, {ay}) to ({bx}, {by})")
+                    break
+
+        # Double captures
+        caught = [pokemon for _, pokemon in self.captures]
+        if len(caught) != len(set(caught)):
+            self.failures.append("a pokemon was reported captured more than once")
+
+        in_dexes = [pokemon for pokedex in game.trainer_pokedexes.values() for pokemon in pokedex]
+        if len(in_dexes) != len(set(in_dexes)):
+            self.failures.append("a pokemon is in more than one pokedex")
+        if sorted(in_dexes) != sorted(caught) or len(in_dexes) != game.capture_counter:
+            self.failures.append(f"{len(caught)} captures were reported, {len(in_dexes)} are in pokedexes, capture_counter is {game.capture_counter}")
+        if game.owners != {pokemon: trainer for trainer, pokedex in game.trainer_pokedexes.items() for pokemon in pokedex}:
+            self.failures.append("the owner map disagrees with the pokedexes")
+        if any(pokemon in game.pokemon for pokemon in in_dexes):
+            self.failures.append("a captured pokemon is still on the board")
+
+        # Torn state - every index must agree with the client dicts
+        for clients, cells, grid, paths in ((game.trainers, game.trainer_cells, game.trainer_grid, game.trainer_paths),
+                                            (game.pokemon, game.pokemon_cells, game.pokemon_grid, game.pokemon_paths)):
+            if {loc: name for name, loc in clients.items()} != cells or len(cells) != len(clients):
+                self.failures.append("an occupancy map disagrees with the client locations")
+            if grid.locations != clients:
+                self.failures.append("a spatial index disagrees with the client locations")
+            if any(paths[name][-1] != loc for name, loc in clients.items()):
+                self.failures.append("a path does not end at its client's location")
+
+        # Trainers are drawn over pokemon that share their cell
+        expected = np.zeros_like(game.game_board)
+        for cells in (game.pokemon_cells, game.trainer_cells):
+            for (x, y), name in cells.items():
+                expected[x, y] = game.icon_ids[game.icons[name]]
+
+        for x, y in np.argwhere(game.game_board != expected).tolist():
+            self.failures.append(f"game_board shows the wrong icon at ({x}, {y})")
+        for region, (xa, ya, xb, yb) in enumerate(game.free_cells.bounds):
+            if game.free_cells.free[region] != np.count_nonzero(expected[xa:xb, ya:yb] == 0):
+                self.failures.append(f"free_cells has the wrong count for region {region}")
+            lists = game.free_cells.lists[region]
+            if lists is not None:
+                cells, slots = lists
+                empty = np.flatnonzero(expected[xa:xb, ya:yb] == 0)
+                listed = cells[:game.free_cells.free[region]]
+                if sorted(listed.tolist()) != empty.tolist() or (slots[listed] != np.arange(len(listed))).any():
+                    self.failures.append(f"free_cells has the wrong list of empty cells for region {region}")
+
+        return
+
+
+
+"""
+Start of Program Logic
+
+Usage: python stress.py [board size] [number of trainers] [number of pokemon] [seconds] [region size]
+
+There are only 50 people emojis and 66 animal emojis, so keep the number of trainers and pokemon at or below those
+"""
+
+if __name__ == '__main__':
+    boardsz = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    num_trainers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    num_pkmn = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+    seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 5
+    region_size = int(sys.argv[5]) if len(sys.argv) > 5 else None
+
+    test = StressTest(boardsz, num_trainers, num_pkmn, seconds, region_size)
+    failures = test.run()
+
+    moves = sum(test.accepted_moves.values())
+    print(f"{moves} moves and {len(test.captures)} captures by {num_trainers + num_pkmn} clients in {seconds} seconds")
+    if len(failures) == 0:
+        print("PASS")
+    else:
+        for failure in failures[:20]:
+            print("FAIL: " + failure)
+        sys.exit(1)